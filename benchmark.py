@@ -0,0 +1,302 @@
+"""Benchmarks for the badge hot path.
+
+    python3 benchmark.py [BENCHMARK ...] [--repeat N] [--json FILE]
+
+Without arguments all benchmarks run. Results are printed as tables and
+optionally written as JSON so runs on different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import timeit
+import tracemalloc
+
+import easybadges
+from rating.blueprint import RATING_OPTIONS, RATING_BADGE_VARIANTS, rating_badge_args
+
+REPEAT = 50
+
+RENDER_CASES = (
+    ("short", ("Py", "3"), {}),
+    ("long", ("Continuous integration", "passing on all supported platforms"), {}),
+    ("small font", ("Rating", "(A) Excellent"), {"font_size": 10}),
+    ("large font", ("Rating", "(A) Excellent"), {"font_size": 24}),
+    ("variants", ("Rating", "(A) Excellent"), {"variants": RATING_BADGE_VARIANTS}),
+)
+
+
+def measure(func, repeat):
+    """Mean wall time in milliseconds and peak Python heap usage (tracemalloc) in bytes."""
+    seconds = timeit.timeit(func, number=repeat) / repeat
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds * 1000, peak
+
+
+def peak_rss(func):
+    """Growth of the peak resident set size in bytes while func runs once in a forked child.
+    
+    Unlike tracemalloc, this includes native allocations such as PIL image buffers and zlib state,
+    but also pages copied on write in the child, so small operations show a constant floor of about
+    2 MB. Returns None where fork() or the resource module are not available."""
+    try:
+        import resource
+        fork = os.fork
+    except (ImportError, AttributeError):
+        return None
+    read, write = os.pipe()
+    pid = fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in kilobytes on Linux.
+            os.write(write, str((after - before) * 1024).encode("ascii"))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, "rb") as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    return int(data) if data else None
+
+
+def rating_badges():
+    badges = []
+    for rating in RATING_OPTIONS:
+        args, kwargs = rating_badge_args(rating)
+        badges.append((rating, easybadges.badge(*args, **kwargs)))
+    return badges
+
+
+def render_cases():
+    cases = list(RENDER_CASES)
+    for rating in RATING_OPTIONS:
+        args, kwargs = rating_badge_args(rating)
+        cases.append(("rating " + rating, args, kwargs))
+    return cases
+
+
+def bench_render(repeat=REPEAT):
+    """Render and encode time, peak memory and PNG size of representative badges.
+    
+    Peaks are reported for rendering and encoding separately: the encoder's zlib buffers would
+    otherwise hide the render peak."""
+    results = []
+    for name, args, kwargs in render_cases():
+        kwargs = dict(kwargs)
+        font_size = kwargs.pop("font_size", 14)
+        render_ms, render_peak = measure(lambda: easybadges.badge(*args, font_size=font_size, **kwargs), repeat)
+        img = easybadges.badge(*args, font_size=font_size, **kwargs)
+        encode_ms, encode_peak = measure(lambda: easybadges.encode_png(img), repeat)
+        render_rss = peak_rss(lambda: easybadges.badge(*args, font_size=font_size, **kwargs))
+        encode_rss = peak_rss(lambda: easybadges.encode_png(img))
+        results.append({
+            "case": name,
+            "size": "%dx%d" % img.size,
+            "render_ms": render_ms,
+            "encode_ms": encode_ms,
+            "render_peak_bytes": render_peak,
+            "encode_peak_bytes": encode_peak,
+            "render_rss_bytes": render_rss,
+            "encode_rss_bytes": encode_rss,
+            "bytes": len(easybadges.encode_png(img)),
+        })
+    return results
+
+
+def bench_encode(repeat=REPEAT):
+    """Encode time and size of the seven rating badges for each encoding profile."""
+    badges = rating_badges()
+    results = []
+    for name, profile in sorted(easybadges.PROFILES.items()):
+        for rating, img in badges:
+            seconds = timeit.timeit(lambda: easybadges.encode_png(img, profile), number=repeat) / repeat
+            size = len(easybadges.encode_png(img, profile))
+            results.append({"profile": name, "rating": rating, "encode_ms": seconds * 1000, "bytes": size})
+    return results
+
+
+def bench_request(repeat=REPEAT):
+    """End-to-end latency of the rating routes through the Flask test client."""
+    from flask import Flask
+    import uorm.sqlite
+    import rating
+    from rating.models import WebAppRating, VersionRating
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        uorm.sqlite.connect(os.path.join(directory, "benchmark.sqlite"), namespace="benchmark")
+        app = Flask(__name__)
+        app.secret_key = "benchmark"
+        app.register_blueprint(rating.blueprint)
+        web_app = WebAppRating.entities.create(app_id="benchmark", app_name="Benchmark", rating={})
+        VersionRating.set_version(web_app, "1.0", "A", "", "")
+        VersionRating.set_version(web_app, "2.0", "C", "", "")
+        client = app.test_client()
+        for url in ("/index.json", "/benchmark.json", "/benchmark/1.0.json",
+            "/benchmark/latest.png", "/benchmark/1.0.png", "/benchmark/latest.svg"):
+            response = client.get(url)
+            etag = response.headers.get("ETag")
+            latency_ms, peak = measure(lambda: client.get(url), repeat)
+            headers = {"If-None-Match": etag} if etag else {}
+            not_modified_ms = timeit.timeit(lambda: client.get(url, headers=headers), number=repeat) / repeat * 1000
+            results.append({
+                "url": url,
+                "status": response.status_code,
+                "latency_ms": latency_ms,
+                "not_modified_ms": not_modified_ms,
+                "peak_bytes": peak,
+                "bytes": len(response.data),
+            })
+        uorm.get_default_db().close()
+    return results
+
+
+def bench_bulk(repeat=REPEAT, count=1000):
+    """Saving a catalog row by row compared with EntityManager.bulk_create()."""
+    import uorm.sqlite
+    from rating.models import WebAppRating
+
+    def entities(prefix):
+        return [WebAppRating(app_id="%s%d" % (prefix, i), app_name="%s %d" % (prefix, i),
+            rating={"1.0": {"rating": "A", "reason": "", "link": ""}}) for i in range(count)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        uorm.sqlite.connect(os.path.join(directory, "benchmark.sqlite"), namespace="benchmark")
+        for method, save in (
+            ("save loop", lambda batch: [entity.save() for entity in batch]),
+            ("bulk_create", WebAppRating.entities.bulk_create)):
+            batch = entities(method.replace(" ", "_"))
+            seconds = timeit.timeit(lambda: save(batch), number=1)
+            results.append({"method": method, "rows": count, "total_ms": seconds * 1000,
+                "row_us": seconds / count * 1000000})
+        uorm.get_default_db().close()
+    return results
+
+
+def bench_entities(repeat=REPEAT, count=100000):
+    """Materializing WebAppRating entities from database rows and reading their attributes."""
+    from rating.models import WebAppRating
+
+    rows = [{"_id": i, "app_id": "app%d" % i, "app_name": "App %d" % i, "modified": i,
+        "rating": b'{"1.0": {"rating": "A", "reason": "", "link": ""}}'} for i in range(count)]
+    load_seconds = timeit.timeit(lambda: [WebAppRating._from_data(dict(row)) for row in rows], number=1)
+    entities = [WebAppRating._from_data(dict(row)) for row in rows]
+    read_seconds = timeit.timeit(lambda: [(e._id, e.app_id, e.app_name, e.modified) for e in entities], number=1)
+    write_seconds = timeit.timeit(lambda: [setattr(e, "app_name", "Renamed") for e in entities], number=1)
+    tracemalloc.start()
+    try:
+        entities = [WebAppRating._from_data(dict(row)) for row in rows]
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return [{
+        "entities": count,
+        "load_us": load_seconds / count * 1000000,
+        "read_4_attrs_us": read_seconds / count * 1000000,
+        "write_us": write_seconds / count * 1000000,
+        "bytes_per_entity": size // count,
+    }]
+
+
+def bench_async(repeat=REPEAT, count=1000, requests=2000):
+    """Throughput of concurrent lookups through the asyncio facade compared with a blocking loop."""
+    import asyncio
+    import uorm.sqlite
+    from rating.models import WebAppRating
+
+    async def lookups(concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def lookup(i):
+            async with semaphore:
+                await WebAppRating.entities.aget(app_id="app%d" % (i % count))
+
+        await asyncio.gather(*(lookup(i) for i in range(requests)))
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        uorm.sqlite.connect(os.path.join(directory, "benchmark.sqlite"), namespace="benchmark")
+        WebAppRating.entities.bulk_create([WebAppRating(app_id="app%d" % i, app_name="App %d" % i,
+            rating={"1.0": {"rating": "A", "reason": "", "link": ""}}) for i in range(count)])
+        seconds = timeit.timeit(lambda: [WebAppRating.entities.get(app_id="app%d" % (i % count))
+            for i in range(requests)], number=1)
+        results.append({"method": "blocking", "concurrency": 1, "requests": requests,
+            "total_ms": seconds * 1000, "requests_per_s": requests / seconds})
+        for concurrency in (1, 8, 64):
+            seconds = timeit.timeit(lambda: asyncio.run(lookups(concurrency)), number=1)
+            results.append({"method": "asyncio", "concurrency": concurrency, "requests": requests,
+                "total_ms": seconds * 1000, "requests_per_s": requests / seconds})
+        db = uorm.get_default_db()
+        uorm.aio.shutdown(db)
+        db.close()
+    return results
+
+
+BENCHMARKS = {
+    "render": bench_render,
+    "encode": bench_encode,
+    "request": bench_request,
+    "bulk": bench_bulk,
+    "entities": bench_entities,
+    "async": bench_async,
+}
+
+
+def print_table(name, results):
+    print("== %s ==" % name)
+    if not results:
+        return
+    columns = list(results[0])
+    print("  ".join("%14s" % c for c in columns))
+    for entry in results:
+        print("  ".join("%14.3f" % v if isinstance(v, float) else "%14s" % v for v in (entry[c] for c in columns)))
+    print()
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Badge hot path benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+        help="one of %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="iterations per measurement")
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+
+    report = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        results = BENCHMARKS[name](args.repeat)
+        report["results"][name] = results
+        print_table(name, results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
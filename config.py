@@ -1,5 +1,16 @@
 PASSWORD_HASH_METHOD = "pbkdf2:sha256:36000"
 PROJECT_ID = "nuvola-rating"
+# Log every database operation at DEBUG level through the "uorm" logger.
+LOG_QUERIES = False
+# Report per-request query count and time in the Server-Timing header.
+QUERY_STATS = False
+# Keep an identity map per request and write its saves in one transaction at the end.
+UNIT_OF_WORK = False
+# Run EXPLAIN QUERY PLAN for every query shape and log those scanning tables or sorting in temp B-trees.
+AUDIT_QUERY_PLANS = False
+# Encoding of PNG rating badges: "max" is lossless; "palette" makes them roughly half the size
+# but quantizes them to 256 colours, which shifts anti-aliased text edges by up to ~27 levels per channel.
+BADGE_PNG_PROFILE = "max"
 
 from config_secret import *
 
@@ -0,0 +1,329 @@
+# Generated by MakeAdvances.py from Data/DejaVuSans.ttf - do not edit.
+
+FACE = 'DejaVuSans'
+UNITS_PER_EM = 2048
+ASCENT = 1901
+DESCENT = -483
+DEFAULT_ADVANCE = 1229
+
+ADVANCES = {
+	0x0020: 651,
+	0x0021: 821,
+	0x0022: 942,
+	0x0023: 1716,
+	0x0024: 1303,
+	0x0025: 1946,
+	0x0026: 1597,
+	0x0027: 563,
+	0x0028: 799,
+	0x0029: 799,
+	0x002A: 1024,
+	0x002B: 1716,
+	0x002C: 651,
+	0x002D: 739,
+	0x002E: 651,
+	0x002F: 690,
+	0x0030: 1303,
+	0x0031: 1303,
+	0x0032: 1303,
+	0x0033: 1303,
+	0x0034: 1303,
+	0x0035: 1303,
+	0x0036: 1303,
+	0x0037: 1303,
+	0x0038: 1303,
+	0x0039: 1303,
+	0x003A: 690,
+	0x003B: 690,
+	0x003C: 1716,
+	0x003D: 1716,
+	0x003E: 1716,
+	0x003F: 1087,
+	0x0040: 2048,
+	0x0041: 1401,
+	0x0042: 1405,
+	0x0043: 1430,
+	0x0044: 1577,
+	0x0045: 1294,
+	0x0046: 1178,
+	0x0047: 1587,
+	0x0048: 1540,
+	0x0049: 604,
+	0x004A: 604,
+	0x004B: 1343,
+	0x004C: 1141,
+	0x004D: 1767,
+	0x004E: 1532,
+	0x004F: 1612,
+	0x0050: 1235,
+	0x0051: 1612,
+	0x0052: 1423,
+	0x0053: 1300,
+	0x0054: 1251,
+	0x0055: 1499,
+	0x0056: 1401,
+	0x0057: 2025,
+	0x0058: 1403,
+	0x0059: 1251,
+	0x005A: 1403,
+	0x005B: 799,
+	0x005C: 690,
+	0x005D: 799,
+	0x005E: 1716,
+	0x005F: 1024,
+	0x0060: 1024,
+	0x0061: 1255,
+	0x0062: 1300,
+	0x0063: 1126,
+	0x0064: 1300,
+	0x0065: 1260,
+	0x0066: 721,
+	0x0067: 1300,
+	0x0068: 1298,
+	0x0069: 569,
+	0x006A: 569,
+	0x006B: 1186,
+	0x006C: 569,
+	0x006D: 1995,
+	0x006E: 1298,
+	0x006F: 1253,
+	0x0070: 1300,
+	0x0071: 1300,
+	0x0072: 842,
+	0x0073: 1067,
+	0x0074: 803,
+	0x0075: 1298,
+	0x0076: 1212,
+	0x0077: 1675,
+	0x0078: 1212,
+	0x0079: 1212,
+	0x007A: 1075,
+	0x007B: 1303,
+	0x007C: 690,
+	0x007D: 1303,
+	0x007E: 1716,
+	0x00A0: 651,
+	0x00A1: 821,
+	0x00A2: 1303,
+	0x00A3: 1303,
+	0x00A4: 1303,
+	0x00A5: 1303,
+	0x00A6: 690,
+	0x00A7: 1024,
+	0x00A8: 1024,
+	0x00A9: 2048,
+	0x00AA: 965,
+	0x00AB: 1253,
+	0x00AC: 1716,
+	0x00AD: 739,
+	0x00AE: 2048,
+	0x00AF: 1024,
+	0x00B0: 1024,
+	0x00B1: 1716,
+	0x00B2: 821,
+	0x00B3: 821,
+	0x00B4: 1024,
+	0x00B5: 1303,
+	0x00B6: 1303,
+	0x00B7: 651,
+	0x00B8: 1024,
+	0x00B9: 821,
+	0x00BA: 965,
+	0x00BB: 1253,
+	0x00BC: 1985,
+	0x00BD: 1985,
+	0x00BE: 1985,
+	0x00BF: 1087,
+	0x00C0: 1401,
+	0x00C1: 1401,
+	0x00C2: 1401,
+	0x00C3: 1401,
+	0x00C4: 1401,
+	0x00C5: 1401,
+	0x00C6: 1995,
+	0x00C7: 1430,
+	0x00C8: 1294,
+	0x00C9: 1294,
+	0x00CA: 1294,
+	0x00CB: 1294,
+	0x00CC: 604,
+	0x00CD: 604,
+	0x00CE: 604,
+	0x00CF: 604,
+	0x00D0: 1587,
+	0x00D1: 1532,
+	0x00D2: 1612,
+	0x00D3: 1612,
+	0x00D4: 1612,
+	0x00D5: 1612,
+	0x00D6: 1612,
+	0x00D7: 1716,
+	0x00D8: 1612,
+	0x00D9: 1499,
+	0x00DA: 1499,
+	0x00DB: 1499,
+	0x00DC: 1499,
+	0x00DD: 1251,
+	0x00DE: 1239,
+	0x00DF: 1290,
+	0x00E0: 1255,
+	0x00E1: 1255,
+	0x00E2: 1255,
+	0x00E3: 1255,
+	0x00E4: 1255,
+	0x00E5: 1255,
+	0x00E6: 2011,
+	0x00E7: 1126,
+	0x00E8: 1260,
+	0x00E9: 1260,
+	0x00EA: 1260,
+	0x00EB: 1260,
+	0x00EC: 569,
+	0x00ED: 569,
+	0x00EE: 569,
+	0x00EF: 569,
+	0x00F0: 1253,
+	0x00F1: 1298,
+	0x00F2: 1253,
+	0x00F3: 1253,
+	0x00F4: 1253,
+	0x00F5: 1253,
+	0x00F6: 1253,
+	0x00F7: 1716,
+	0x00F8: 1253,
+	0x00F9: 1298,
+	0x00FA: 1298,
+	0x00FB: 1298,
+	0x00FC: 1298,
+	0x00FD: 1212,
+	0x00FE: 1300,
+	0x00FF: 1212,
+	0x0100: 1401,
+	0x0101: 1255,
+	0x0102: 1401,
+	0x0103: 1255,
+	0x0104: 1401,
+	0x0105: 1255,
+	0x0106: 1430,
+	0x0107: 1126,
+	0x0108: 1430,
+	0x0109: 1126,
+	0x010A: 1430,
+	0x010B: 1126,
+	0x010C: 1430,
+	0x010D: 1126,
+	0x010E: 1577,
+	0x010F: 1300,
+	0x0110: 1587,
+	0x0111: 1300,
+	0x0112: 1294,
+	0x0113: 1260,
+	0x0114: 1294,
+	0x0115: 1260,
+	0x0116: 1294,
+	0x0117: 1260,
+	0x0118: 1294,
+	0x0119: 1260,
+	0x011A: 1294,
+	0x011B: 1260,
+	0x011C: 1587,
+	0x011D: 1300,
+	0x011E: 1587,
+	0x011F: 1300,
+	0x0120: 1587,
+	0x0121: 1300,
+	0x0122: 1587,
+	0x0123: 1300,
+	0x0124: 1540,
+	0x0125: 1298,
+	0x0126: 1876,
+	0x0127: 1423,
+	0x0128: 604,
+	0x0129: 569,
+	0x012A: 604,
+	0x012B: 569,
+	0x012C: 604,
+	0x012D: 569,
+	0x012E: 604,
+	0x012F: 569,
+	0x0130: 604,
+	0x0131: 569,
+	0x0132: 1208,
+	0x0133: 1138,
+	0x0134: 604,
+	0x0135: 569,
+	0x0136: 1343,
+	0x0137: 1186,
+	0x0138: 1186,
+	0x0139: 1141,
+	0x013A: 569,
+	0x013B: 1141,
+	0x013C: 569,
+	0x013D: 1141,
+	0x013E: 768,
+	0x013F: 1141,
+	0x0140: 700,
+	0x0141: 1151,
+	0x0142: 582,
+	0x0143: 1532,
+	0x0144: 1298,
+	0x0145: 1532,
+	0x0146: 1298,
+	0x0147: 1532,
+	0x0148: 1298,
+	0x0149: 1666,
+	0x014A: 1532,
+	0x014B: 1298,
+	0x014C: 1612,
+	0x014D: 1253,
+	0x014E: 1612,
+	0x014F: 1253,
+	0x0150: 1612,
+	0x0151: 1253,
+	0x0152: 2191,
+	0x0153: 2095,
+	0x0154: 1423,
+	0x0155: 842,
+	0x0156: 1423,
+	0x0157: 842,
+	0x0158: 1423,
+	0x0159: 842,
+	0x015A: 1300,
+	0x015B: 1067,
+	0x015C: 1300,
+	0x015D: 1067,
+	0x015E: 1300,
+	0x015F: 1067,
+	0x0160: 1300,
+	0x0161: 1067,
+	0x0162: 1251,
+	0x0163: 803,
+	0x0164: 1251,
+	0x0165: 803,
+	0x0166: 1251,
+	0x0167: 803,
+	0x0168: 1499,
+	0x0169: 1298,
+	0x016A: 1499,
+	0x016B: 1298,
+	0x016C: 1499,
+	0x016D: 1298,
+	0x016E: 1499,
+	0x016F: 1298,
+	0x0170: 1499,
+	0x0171: 1298,
+	0x0172: 1499,
+	0x0173: 1298,
+	0x0174: 2025,
+	0x0175: 1675,
+	0x0176: 1251,
+	0x0177: 1212,
+	0x0178: 1251,
+	0x0179: 1403,
+	0x017A: 1075,
+	0x017B: 1403,
+	0x017C: 1075,
+	0x017D: 1403,
+	0x017E: 1075,
+	0x017F: 721,
+}
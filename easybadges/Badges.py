@@ -1,13 +1,54 @@
-from PIL import Image, ImageFont, ImageDraw
+from PIL import Image, ImageDraw
 import math
 
-def Badge(A, B, fh = 14, pw = 6, ph = 4, r = 4, d = 1, color = (0x00, 0x7E, 0xC6), variants=None):
-	font = ImageFont.truetype('Data/DejaVuSans.ttf', fh)
-	A_size = font.getsize(A)[0]
+from .Fonts import DEFAULT_FACE, getFont, textWidth, maxTextWidth
+
+GRADIENT = 0xB8
+GRADIENT_FACTOR = 0.15
+
+def blendColor(c, base, f):
+	return (
+		round(c[0] * f + base[0] * (1 - f)),
+		round(c[1] * f + base[1] * (1 - f)),
+		round(c[2] * f + base[2] * (1 - f)),
+	)
+
+def CornerMask(w, h, r):
+	# Only the r x r corner pixels ever differ from full opacity, so the
+	# anti-aliasing is computed for those alone and written into a flat mask.
+	mask = bytearray(b'\xFF') * (w * h)
+	cx = r - 1
+	cy = r - 1
+	for i in range(r):
+		for j in range(r):
+			a = 1 - min(max(math.sqrt((i - cx) ** 2 + (j - cy) ** 2) - r + 1, 0), 1)
+			for x, y in ((i, j), (w - i - 1, j), (i, h - j - 1), (w - i - 1, h - j - 1)):
+				mask[y * w + x] = round(mask[y * w + x] * a)
+	return Image.frombytes('L', (w, h), bytes(mask))
+
+def Background(w, h, s, r, left, right):
+	# The gradient depends only on the row and both panels are solid colors,
+	# so every row is just two runs of a single blended color each.
+	rows = []
+	for j in range(h):
+		g = round(GRADIENT * (1 - j / (h - 1)))
+		grad = (g, g, g)
+		rows.append(bytes(blendColor(grad, left, GRADIENT_FACTOR)) * s)
+		rows.append(bytes(blendColor(grad, right, GRADIENT_FACTOR)) * (w - s))
+	img = Image.frombytes('RGB', (w, h), b''.join(rows))
+	img.putalpha(CornerMask(w, h, r))
+	return img
+
+def Badge(A, B, fh = 14, pw = 6, ph = 4, r = 4, d = 1, color = (0x00, 0x7E, 0xC6), variants=None, face=DEFAULT_FACE, scale = 1):
+	if scale != 1:
+		# Render natively at the higher density rather than upscaling.
+		fh, pw, ph, r, d = (round(v * scale) for v in (fh, pw, ph, r, d))
+	font = getFont(face, fh)
+	A_size = textWidth(face, fh, A)
 	if variants:
-		B_size = max([font.getsize(v)[0] for v in variants])
+		B_size = maxTextWidth(face, fh, tuple(variants))
 	else:
-		B_size = font.getsize(B)[0]
+		B_size = textWidth(face, fh, B)
 	
 	s = A_size + 2 * pw
 	w = s + B_size + 2 * pw
@@ -16,44 +57,7 @@ def Badge(A, B, fh = 14, pw = 6, ph = 4, r = 4, d = 1, color = (0x00, 0x7E, 0xC6
 	left = (0x58, 0x58, 0x58, 0xFF)
 	right = tuple(color) + (0xFF,)
 
-	img = Image.new('RGBA', (w, h))
-	px = img.load()
-
-	def mulAlpha(px, i, j, a):
-		px[i, j] = (px[i, j][0], px[i, j][1], px[i, j][2], round(px[i, j][3] * a))
-
-	def blendColor(px, i, j, c, f):
-		r = round(c[0] * f + px[i, j][0] * (1 - f))
-		g = round(c[1] * f + px[i, j][1] * (1 - f))
-		b = round(c[2] * f + px[i, j][2] * (1 - f))
-		px[i, j] = (r, g, b, px[i, j][3])
-
-	for i in range(s):
-		for j in range(h):
-			px[i, j] = left
-
-	for i in range(s, w):
-		for j in range(h):
-			px[i, j] = right
-
-	for i in range(r):
-		for j in range(r):
-			cx = r - 1
-			cy = r - 1
-			a = 1 - min(max(math.sqrt((i - cx) ** 2 + (j - cy) ** 2) - r + 1, 0), 1)
-			mulAlpha(px, i, j, a)
-			mulAlpha(px, w - i - 1, j, a)
-			mulAlpha(px, i, h - j - 1, a)
-			mulAlpha(px, w - i - 1, h - j - 1, a)
-
-	for i in range(w):
-		for j in range(h):
-			grad = (
-				round(0xB8 * (1 - j / (h - 1))),
-				round(0xB8 * (1 - j / (h - 1))),
-				round(0xB8 * (1 - j / (h - 1))),
-			)
-			blendColor(px, i, j, grad, 0.15)
+	img = Background(w, h, s, r, left, right)
 
 	draw = ImageDraw.Draw(img)
 	draw.text((pw, ph), A, font = font, fill = (0x48, 0x48, 0x48, 0xFF))
@@ -61,3 +65,16 @@ def Badge(A, B, fh = 14, pw = 6, ph = 4, r = 4, d = 1, color = (0x00, 0x7E, 0xC6
 	draw.text((s + pw, ph), B, font = font, fill = (0x48, 0x48, 0x48, 0xFF))
 	draw.text((s + pw, ph - d), B, font = font, fill = (0xFF, 0xFF, 0xFF, 0xFF))
 	return img
+
+def Sprite(images):
+	"""Stack images vertically; returns the sheet and each image's (x, y, w, h) box."""
+	w = max(img.size[0] for img in images)
+	h = sum(img.size[1] for img in images)
+	sheet = Image.new('RGBA', (w, h))
+	boxes = []
+	y = 0
+	for img in images:
+		sheet.paste(img, (0, y))
+		boxes.append((0, y) + img.size)
+		y += img.size[1]
+	return sheet, boxes
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import threading
+
+from .Badges import Badge
+from .Encoders import MAX, getProfile, encodeProfile
+
+DEFAULT_SIZE = 256
+
+def freeze(value):
+	if isinstance(value, (list, tuple)):
+		return tuple(freeze(v) for v in value)
+	return value
+
+class BadgeCache:
+	"""LRU cache of encoded badges keyed by every argument affecting the output."""
+
+	def __init__(self, size=DEFAULT_SIZE, profile=MAX):
+		self.size = size
+		self.profile = getProfile(profile)
+		self.lock = threading.Lock()
+		self.entries = OrderedDict()
+
+	def key(self, left, right, font_size, profile, kwargs):
+		return (left, right, font_size, profile.name) + tuple(sorted((k, freeze(v)) for k, v in kwargs.items()))
+
+	def get(self, left, right, font_size=14, profile=None, **kwargs):
+		profile = getProfile(profile) if profile else self.profile
+		key = self.key(left, right, font_size, profile, kwargs)
+		with self.lock:
+			try:
+				self.entries.move_to_end(key)
+				return self.entries[key]
+			except KeyError:
+				pass
+		data = encodeProfile(Badge(left, right, font_size, **kwargs), profile)
+		with self.lock:
+			self.entries[key] = data
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+		return data
+
+	def warm(self, badges, profile=None):
+		for left, right, font_size, kwargs in badges:
+			self.get(left, right, font_size, profile, **kwargs)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+	def __len__(self):
+		return len(self.entries)
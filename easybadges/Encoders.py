@@ -0,0 +1,28 @@
+from io import BytesIO
+from collections import namedtuple
+
+Profile = namedtuple('Profile', 'name format palette params')
+
+# Live renders: cheapest zlib setting, full RGBA.
+FAST = Profile('fast', 'PNG', False, {'compress_level': 1})
+# Quantized to a 256-color palette with a tRNS chunk; smallest output.
+PALETTE = Profile('palette', 'PNG', True, {'compress_level': 9, 'optimize': True})
+# Lossless maximum compression; only worth it when the result is kept.
+MAX = Profile('max', 'PNG', False, {'compress_level': 9, 'optimize': True})
+
+PROFILES = {profile.name: profile for profile in (FAST, PALETTE, MAX)}
+
+def getProfile(profile):
+	return PROFILES[profile] if isinstance(profile, str) else profile
+
+def encode(img, format, **params):
+	buffer = BytesIO()
+	img.save(buffer, format, **params)
+	return buffer.getvalue()
+
+def encodeProfile(img, profile=FAST):
+	profile = getProfile(profile)
+	if profile.palette:
+		# Fast octree is the quantizer that keeps the alpha channel.
+		img = img.quantize(256, 2)
+	return encode(img, profile.format, **profile.params)
@@ -0,0 +1,24 @@
+from PIL import ImageFont
+from functools import lru_cache
+import os
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data')
+DEFAULT_FACE = 'DejaVuSans'
+
+def fontPath(face):
+	return os.path.join(DATA_DIR, face + '.ttf')
+
+def faces():
+	return sorted(name[:-4] for name in os.listdir(DATA_DIR) if name.endswith('.ttf'))
+
+@lru_cache(maxsize=None)
+def getFont(face, size):
+	return ImageFont.truetype(fontPath(face), size)
+
+@lru_cache(maxsize=4096)
+def textWidth(face, size, text):
+	return getFont(face, size).getsize(text)[0]
+
+@lru_cache(maxsize=256)
+def maxTextWidth(face, size, texts):
+	return max(textWidth(face, size, text) for text in texts)
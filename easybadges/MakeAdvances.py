@@ -0,0 +1,86 @@
+"""Extract per-glyph advance widths from a bundled TrueType font.
+
+Regenerates Advances.py, which the SVG renderer uses to measure text
+without loading the font:
+
+    python -m easybadges.MakeAdvances > easybadges/Advances.py
+"""
+import struct
+import sys
+
+from .Fonts import DEFAULT_FACE, fontPath
+
+RANGES = ((0x20, 0x7F), (0xA0, 0x180))
+
+def readTables(data):
+	numTables = struct.unpack('>H', data[4:6])[0]
+	tables = {}
+	for i in range(numTables):
+		tag, checksum, offset, length = struct.unpack('>4sIII', data[12 + 16 * i:28 + 16 * i])
+		tables[tag.decode('ascii')] = data[offset:offset + length]
+	return tables
+
+def readCmap(cmap):
+	numTables = struct.unpack('>H', cmap[2:4])[0]
+	for i in range(numTables):
+		platform, encoding, offset = struct.unpack('>HHI', cmap[4 + 8 * i:12 + 8 * i])
+		if platform == 3 and encoding == 1 and struct.unpack('>H', cmap[offset:offset + 2])[0] == 4:
+			break
+	else:
+		raise ValueError('No Unicode BMP (format 4) cmap subtable.')
+	segX2 = struct.unpack('>H', cmap[offset + 6:offset + 8])[0]
+	segs = segX2 // 2
+	base = offset + 14
+	ends = struct.unpack('>%dH' % segs, cmap[base:base + segX2])
+	starts = struct.unpack('>%dH' % segs, cmap[base + segX2 + 2:base + 2 * segX2 + 2])
+	deltas = struct.unpack('>%dh' % segs, cmap[base + 2 * segX2 + 2:base + 3 * segX2 + 2])
+	rangeBase = base + 3 * segX2 + 2
+	rangeOffsets = struct.unpack('>%dH' % segs, cmap[rangeBase:rangeBase + segX2])
+	mapping = {}
+	for k in range(segs):
+		for code in range(starts[k], ends[k] + 1):
+			if code == 0xFFFF:
+				continue
+			if rangeOffsets[k] == 0:
+				glyph = (code + deltas[k]) & 0xFFFF
+			else:
+				at = rangeBase + 2 * k + rangeOffsets[k] + 2 * (code - starts[k])
+				glyph = struct.unpack('>H', cmap[at:at + 2])[0]
+				if glyph:
+					glyph = (glyph + deltas[k]) & 0xFFFF
+			if glyph:
+				mapping[code] = glyph
+	return mapping
+
+def readAdvances(path):
+	with open(path, 'rb') as f:
+		data = f.read()
+	tables = readTables(data)
+	unitsPerEm = struct.unpack('>H', tables['head'][18:20])[0]
+	ascent, descent = struct.unpack('>hh', tables['hhea'][4:8])
+	numMetrics = struct.unpack('>H', tables['hhea'][34:36])[0]
+	hmtx = tables['hmtx']
+	metrics = [struct.unpack('>H', hmtx[4 * i:4 * i + 2])[0] for i in range(numMetrics)]
+	cmap = readCmap(tables['cmap'])
+	advances = {}
+	for start, stop in RANGES:
+		for code in range(start, stop):
+			if code in cmap:
+				advances[code] = metrics[min(cmap[code], numMetrics - 1)]
+	return unitsPerEm, ascent, descent, metrics[0], advances
+
+def main(face=DEFAULT_FACE, out=sys.stdout):
+	unitsPerEm, ascent, descent, default, advances = readAdvances(fontPath(face))
+	out.write('# Generated by MakeAdvances.py from Data/%s.ttf - do not edit.\n\n' % face)
+	out.write('FACE = %r\n' % face)
+	out.write('UNITS_PER_EM = %d\n' % unitsPerEm)
+	out.write('ASCENT = %d\n' % ascent)
+	out.write('DESCENT = %d\n' % descent)
+	out.write('DEFAULT_ADVANCE = %d\n\n' % default)
+	out.write('ADVANCES = {\n')
+	for code in sorted(advances):
+		out.write('\t0x%04X: %d,\n' % (code, advances[code]))
+	out.write('}\n')
+
+if __name__ == '__main__':
+	main(*sys.argv[1:])
@@ -0,0 +1,34 @@
+from xml.sax.saxutils import escape
+
+from .Advances import UNITS_PER_EM, ASCENT, DEFAULT_ADVANCE, ADVANCES
+
+TEMPLATE = '''<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}">\
+<linearGradient id="g" x2="0" y2="100%"><stop offset="0" stop-color="#b8b8b8" stop-opacity=".15"/>\
+<stop offset="1" stop-opacity=".15"/></linearGradient>\
+<clipPath id="c"><rect width="{w}" height="{h}" rx="{r}"/></clipPath>\
+<g clip-path="url(#c)"><rect width="{s}" height="{h}" fill="#585858"/>\
+<rect x="{s}" width="{B_w}" height="{h}" fill="{color}"/>\
+<rect width="{w}" height="{h}" fill="url(#g)"/></g>\
+<g font-family="DejaVu Sans,Verdana,sans-serif" font-size="{fh}">\
+<text x="{pw}" y="{y}" fill="#484848">{A}</text><text x="{pw}" y="{y_d}" fill="#fff">{A}</text>\
+<text x="{B_x}" y="{y}" fill="#484848">{B}</text><text x="{B_x}" y="{y_d}" fill="#fff">{B}</text></g></svg>'''
+
+def textWidth(text, fh):
+	units = sum(ADVANCES.get(ord(c), DEFAULT_ADVANCE) for c in text)
+	return round(units * fh / UNITS_PER_EM)
+
+def SvgBadge(A, B, fh = 14, pw = 6, ph = 4, r = 4, d = 1, color = (0x00, 0x7E, 0xC6), variants=None):
+	A_size = textWidth(A, fh)
+	if variants:
+		B_size = max(textWidth(v, fh) for v in variants)
+	else:
+		B_size = textWidth(B, fh)
+
+	s = A_size + 2 * pw
+	w = s + B_size + 2 * pw
+	h = fh + 2 * ph
+	y = ph + round(ASCENT * fh / UNITS_PER_EM)
+
+	return TEMPLATE.format(
+		w = w, h = h, r = r, s = s, B_w = w - s, fh = fh, pw = pw, B_x = s + pw, y = y, y_d = y - d,
+		color = '#%02x%02x%02x' % tuple(color[:3]), A = escape(A), B = escape(B))
@@ -1,4 +1,4 @@
-from Badges import Badge
+from easybadges import Badge
 
 img = Badge('Python', '2.7')
 img.save('Python-27.png')
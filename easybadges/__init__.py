@@ -1,5 +1,23 @@
-from .Badges import Badge
+from .Badges import Badge, Sprite
+from .Encoders import FAST, PALETTE, MAX, PROFILES, encode, encodeProfile
+from .Cache import BadgeCache
+from .Fonts import faces
+from .Svg import SvgBadge
+
+png_cache = BadgeCache(profile=MAX)
 
 def badge(left, right, font_size=14, **kwargs):
     return Badge(left, right, font_size, **kwargs)
+
+def sprite(images):
+    return Sprite(images)
+
+def encode_png(img, profile=FAST):
+    return encodeProfile(img, profile)
+
+def badge_png(left, right, font_size=14, profile=None, **kwargs):
+    return png_cache.get(left, right, font_size, profile, **kwargs)
+
+def badge_svg(left, right, font_size=14, **kwargs):
+    return SvgBadge(left, right, font_size, **kwargs)
     
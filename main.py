@@ -1,6 +1,10 @@
+import atexit
 import logging
 import config
 from flask import Flask
+from uorm import instrumentation
+from uorm.audit import PlanAudit
+import uorm
 import uorm.sqlite 
 import rating
 import uauth
@@ -11,13 +15,41 @@ if __name__ == '__main__':
 db_file += ".sqlite"
 
 uorm.sqlite.connect(db_file, namespace="nuvola")
+atexit.register(lambda: uorm.get_default_db().close())
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
 uauth.add_admin(config.ADMIN_USERNAME, config.ADMIN_PASSWORD)
+rating.set_badge_profile(config.BADGE_PNG_PROFILE)
 app.register_blueprint(rating.blueprint)
 app.register_blueprint(uauth.blueprint)
 
+if config.LOG_QUERIES:
+    instrumentation.add_hook(instrumentation.LoggingHook())
+
+if config.AUDIT_QUERY_PLANS:
+    uorm.get_default_db().enable_plan_audit(PlanAudit())
+
+if config.QUERY_STATS:
+    query_stats = instrumentation.add_hook(instrumentation.QueryStats())
+    
+    @app.before_request
+    def reset_query_stats():
+        query_stats.reset()
+    
+    @app.after_request
+    def add_query_stats(response):
+        response.headers.add("Server-Timing", 'db;dur=%.3f;desc="%d queries"' % (
+            query_stats.duration * 1000, query_stats.count))
+        return response
+
+if config.UNIT_OF_WORK:
+    uorm.session.init_app(app)
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    uorm.get_default_db().release()
+
 @app.errorhandler(500)
 def server_error(e):
     logging.exception('An error occurred during a request.')
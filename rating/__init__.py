@@ -1 +1 @@
-from .blueprint import blueprint
+from .blueprint import blueprint, set_badge_profile
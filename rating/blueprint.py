@@ -1,8 +1,11 @@
-from flask import Blueprint, render_template, request, url_for, redirect, flash, jsonify, send_file
-from rating.models import WebAppRating
+from flask import Blueprint, render_template, request, url_for, redirect, flash, jsonify, send_file, Response
+from rating.models import WebAppRating, VersionRating
 import easybadges
 from io import BytesIO
 from collections import namedtuple
+from datetime import datetime
+from werkzeug.http import is_resource_modified
+import hashlib
 import re
 import uauth
 
@@ -33,32 +36,177 @@ RATING_COLORS = {
 
 RATING_OPTIONS = tuple(sorted(RATING_LABELS.keys()))
 
+# Lossless by default; set_badge_profile(easybadges.PALETTE) trades exact anti-aliasing for smaller badges.
+RATING_BADGE_PROFILE = easybadges.MAX
+# Scales that are not warmed are rendered on request, where encoding time matters more than size.
+LIVE_BADGE_PROFILE = easybadges.FAST
+MAX_BADGE_SCALE = 4
+WARM_BADGE_SCALES = (1, 2)
+BADGE_SCALE_REGEX = re.compile("^(.+)@([1-9])x$")
+
+RATING_BADGE_VARIANTS = tuple("(%s) %s" % entry for entry in sorted(RATING_LABELS.items()))
+
 AppIndexEntry = namedtuple("AppIndexEntry", "id name version rating reason link")
+# versions is a list of (version, info) pairs, latest first.
+AppRatings = namedtuple("AppRatings", "app_id app_name versions")
+
+def load_app_ratings(apps):
+    """Pair apps with ratings of their versions, loaded by a single query."""
+    versions = VersionRating.for_apps()
+    return [AppRatings(app.app_id, app.app_name,
+        [(r.version, r.info()) for r in versions.get(app._id, ())]) for app in apps]
+
+def app_ratings(app):
+    """AppRatings of a single app."""
+    return AppRatings(app.app_id, app.app_name, [(r.version, r.info()) for r in VersionRating.for_app(app)])
+
+def select_rating(version, get, get_latest=None):
+    """Return (version, info) of the rating shown for a requested version.
+    
+    "latest" is the highest version if get_latest is given, other versions are looked up by get.
+    Both fall back to the "*" wildcard version, whose info is None if it is not rated either."""
+    if version == "latest" and get_latest is not None:
+        latest = get_latest()
+        if latest:
+            return latest
+    else:
+        info = get(version)
+        if info is not None:
+            return version, info
+    return "*", get("*")
+
+def select_app_rating(app, version, latest=False):
+    """select_rating() for AppRatings."""
+    rating_map = dict(app.versions)
+    get_latest = (lambda: app.versions[0] if app.versions else None) if latest else None
+    return select_rating(version, rating_map.get, get_latest)
+
+def select_stored_rating(app, version, latest=False):
+    """select_rating() for a WebAppRating entity, each version looked up by a single indexed query."""
+    def get(version):
+        version_rating = VersionRating.get_version(app, version)
+        return version_rating.info() if version_rating else None
+    
+    def get_latest():
+        version_rating = VersionRating.get_latest(app)
+        return (version_rating.version, version_rating.info()) if version_rating else None
+    
+    return select_rating(version, get, get_latest if latest else None)
+
+RatingSprite = namedtuple("RatingSprite", "data etag boxes")
+_rating_sprite = None
+def index_document(apps):
+    web_apps = []
+    for app in apps:
+        if app.versions:
+            version, info = app.versions[0]
+            info = dict(info)
+            info["version"] = version
+        else:
+            info = {
+                "version": "*",
+                "rating": "X",
+                "reason": None,
+                "link": None,
+            }
+        info["id"] = app.app_id
+        info["name"] = app.app_name
+        web_apps.append(info)
+    return {"apps": web_apps, "labels": RATING_LABELS}
+
+def web_app_document(app):
+    versions = [version for version, info in app.versions]
+    return {"sorted": versions or None, "versions": dict(app.versions), "labels": RATING_LABELS}
+
+def web_app_version_document(app_id, app_name, version, info):
+    if info:
+        info = dict(info)
+    else:
+        info = {
+            "rating": "X",
+            "reason": None,
+            "link": None,
+        }
+    info["id"] = app_id
+    info["name"] = app_name
+    info["version"] = version
+    info["label"] = RATING_LABELS[info["rating"]]
+    return info
+
+def badge_rating(info):
+    return info["rating"] if info else "X"
+
+
+def rating_badge_args(rating):
+    label = RATING_LABELS[rating]
+    color = RATING_COLORS[rating]
+    return ("Rating", "(%s) %s" % (rating, label)), {"color": color, "variants": RATING_BADGE_VARIANTS}
+
+def set_badge_profile(profile):
+    """Select the encoding profile of warmed PNG badges and the sprite, e.g. from configuration."""
+    global RATING_BADGE_PROFILE, _rating_sprite
+    RATING_BADGE_PROFILE = easybadges.PROFILES[profile] if isinstance(profile, str) else profile
+    _rating_sprite = None
+
+def badge_profile(scale):
+    """Encoding profile of PNG badges at a scale."""
+    return RATING_BADGE_PROFILE if scale in WARM_BADGE_SCALES else LIVE_BADGE_PROFILE
+
+def rating_badge_png(rating, scale=1):
+    args, kwargs = rating_badge_args(rating)
+    return easybadges.badge_png(*args, profile=badge_profile(scale), scale=scale, **kwargs)
+
+def rating_badge_svg(rating):
+    args, kwargs = rating_badge_args(rating)
+    return easybadges.badge_svg(*args, **kwargs)
+
+def rating_sprite():
+    """All rating badges in one image, so a page showing many apps needs a single request."""
+    global _rating_sprite
+    if _rating_sprite is None:
+        images = []
+        for rating in RATING_OPTIONS:
+            args, kwargs = rating_badge_args(rating)
+            images.append(easybadges.badge(*args, **kwargs))
+        img, boxes = easybadges.sprite(images)
+        data = easybadges.encode_png(img, RATING_BADGE_PROFILE)
+        _rating_sprite = RatingSprite(data, hashlib.sha1(data).hexdigest(), dict(zip(RATING_OPTIONS, boxes)))
+    return _rating_sprite
 
-def get_latest_rating(rating_map):
-    versions = get_sorted_versions(rating_map)
-    if not versions:
-        return None, None
-    version = versions[0]
-    return version, rating_map[version]
+def warm_badge_cache(state=None):
+    for scale in WARM_BADGE_SCALES:
+        for rating in RATING_OPTIONS:
+            rating_badge_png(rating, scale)
+    rating_sprite()
 
-def get_sorted_versions(rating_map):
-    versions = list(rating_map.keys())
-    if not versions:
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+def last_modified_date(modified):
+    if modified is False:
         return None
+    return datetime.utcfromtimestamp((modified or 0) // 1000000)
+
+def not_modified(etag, modified=False):
+    """Return a 304 response if the client already has the current representation.
     
-    def key_func(x):
-        x = x.split(".")
-        try:
-            return [int(i) for i in x]
-        except ValueError:
-            return [-1]
-        
-    versions.sort(key=key_func, reverse=True)
-    return versions
+    Pass modified=False for resources without a modification time."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified_date(modified)):
+        return None
+    response = Response(status=304)
+    return add_cache_headers(response, etag, modified)
+
+def add_cache_headers(response, etag, modified=False):
+    response.set_etag(etag)
+    last_modified = last_modified_date(modified)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
 
 
 blueprint = Blueprint(NAME, __name__, template_folder='templates', static_folder='static')
+blueprint.record_once(warm_badge_cache)
 
 @blueprint.route('/', methods=['GET', 'POST'])
 def index():
@@ -106,14 +254,16 @@ def index():
         elif "app_delete" in request.form:
             app_ids = request.form.getlist("app_id")
             if app_ids:
-                for app_id in app_ids:
-                    WebAppRating.entities.delete_by(app_id=app_id)
+                ids = list(WebAppRating.entities.query(filter_by=[("app_id", "in", app_ids)]).values_list(
+                    "_id", flat=True))
+                VersionRating.entities.delete_by(filter_by=[("app", "in", ids)])
+                WebAppRating.entities.delete_by(filter_by=[("app_id", "in", app_ids)])
                 flash("%d Web app instances have been deleted." % len(app_ids), "success")
             return redirect(url_for('.index'))
 
     web_apps = []
-    for app in WebAppRating.entities.query(order_by="app_name").all():
-        version, info = get_latest_rating(app.rating)
+    for app in load_app_ratings(WebAppRating.entities.query(order_by="app_name")):
+        version, info = app.versions[0] if app.versions else (None, None)
         if info:
             rating = info["rating"]
             reason = info.get("reason", "")
@@ -126,26 +276,28 @@ def index():
         web_apps.append(AppIndexEntry(app.app_id, app.app_name, version, rating, reason, link))
             
     return render_template(NAME + '/index.html',
-        web_apps=web_apps, editable=editable, labels=RATING_LABELS, form = form, form_errors=form_errors, edit_id=edit_id)
+        web_apps=web_apps, editable=editable, labels=RATING_LABELS, form = form, form_errors=form_errors, edit_id=edit_id,
+        sprite=rating_sprite())
+
+@blueprint.route('/ratings.png')
+def ratings_png():
+    sprite = rating_sprite()
+    response = not_modified(sprite.etag)
+    if response:
+        return response
+    return add_cache_headers(send_image_data(sprite.data, "image/png"), sprite.etag)
 
 @blueprint.route('/index.json')
 def index_json():
-    web_apps = []
-    for app in WebAppRating.entities.query(order_by="app_name").all():
-        version, info = get_latest_rating(app.rating)
-        if info:
-            info["version"] = version
-        else:
-            info = {
-                "version": "*",
-                "rating": "X",
-                "reason": None,
-                "link": None,
-            }
-        info["id"] = app.app_id
-        info["name"] = app.app_name
-        web_apps.append(info)
-    return jsonify(apps=web_apps, labels=RATING_LABELS)
+    timestamps = list(WebAppRating.entities.query().values_list("modified", flat=True).all())
+    modified = max((t or 0 for t in timestamps), default=0)
+    etag = make_etag("index", len(timestamps), modified)
+    response = not_modified(etag, modified)
+    if response:
+        return response
+    
+    apps = load_app_ratings(WebAppRating.entities.query(order_by="app_name"))
+    return add_cache_headers(jsonify(**index_document(apps)), etag, modified)
 
 @blueprint.route('/<app_id>/', methods=['GET', 'POST'])
 def web_app(app_id):
@@ -161,12 +313,12 @@ def web_app(app_id):
         "rating_link": ""
      }
     if request.method == 'GET' and edit_version:
-        rating = web_app.rating[edit_version]
+        rating = VersionRating.get_version(web_app, edit_version)
         form = {
             "rating_version": edit_version,
-            "rating_rating": rating["rating"],
-            "rating_reason": rating["reason"],
-            "rating_link": rating["link"]
+            "rating_rating": rating.rating,
+            "rating_reason": rating.reason,
+            "rating_link": rating.link
          }  
              
         
@@ -181,7 +333,7 @@ def web_app(app_id):
                 form_errors.append("Version must not be empty.")
             elif version != "*" and not APP_VERSION_REGEX.match(version):
                 form_errors.append("Version number must be in the form of 'MAJOR.MINOR' or '*' as wildchar.")
-            elif version in web_app.rating and version != edit_version:
+            elif version != edit_version and VersionRating.get_version(web_app, version):
                 form_errors.append("This version has been already rated.")
             if not rating:
                 form_errors.append("Rating must not be empty.")
@@ -190,30 +342,21 @@ def web_app(app_id):
             if link and not link.startswith(("http://", "https://")):
                 form_errors.append("Link must start with 'https://' or 'http://'.")
             if not form_errors:
-                if edit_version and edit_version != version:
-                    del web_app.rating[edit_version]
-                
-                web_app.rating[version] = {
-                "rating": rating,
-                "reason": reason,
-                "link": link
-                }
-                web_app.save()
+                VersionRating.set_version(web_app, version, rating, reason, link, replace=edit_version)
                 flash("Web app instance %s (%s) has been updated." % (web_app.app_name, web_app.app_id), "success")
                 return redirect(url_for('.web_app', app_id=app_id))
         
         elif "rating_delete" in request.form:
             rating_versions = request.form.getlist("rating_version")
             if rating_versions:
-                for version in rating_versions:
-                    del web_app.rating[version]
-                web_app.save()
+                VersionRating.delete_versions(web_app, rating_versions)
                 flash("Web app instance %s (%s) has been updated." % (web_app.app_name, web_app.app_id), "success")
                 return redirect(url_for('.web_app', app_id=app_id))
             return redirect(url_for('.web_app', app_id=app_id))
     
-    rating_map = web_app.rating
-    versions = get_sorted_versions(rating_map)
+    version_ratings = VersionRating.for_app(web_app)
+    versions = [r.version for r in version_ratings] or None
+    rating_map = dict((r.version, r.info()) for r in version_ratings)
     return render_template(NAME + '/web_app.html',
         web_app=web_app, editable=editable, versions=versions, rating_map=rating_map,
         labels=RATING_LABELS, options=RATING_OPTIONS, form=form, form_errors=form_errors, edit_version=edit_version)
@@ -221,9 +364,12 @@ def web_app(app_id):
 @blueprint.route('/<app_id>.json')
 def web_app_json(app_id):
     web_app = WebAppRating.entities.get(app_id=app_id)
-    rating_map = web_app.rating
-    versions = get_sorted_versions(rating_map)
-    return jsonify(sorted=versions, versions=rating_map, labels=RATING_LABELS)
+    etag = make_etag("app", web_app._id, web_app.modified)
+    response = not_modified(etag, web_app.modified)
+    if response:
+        return response
+    
+    return add_cache_headers(jsonify(**web_app_document(app_ratings(web_app))), etag, web_app.modified)
 
 @blueprint.route('/<app_id>/<version>/')
 def web_app_rating(app_id, version):
@@ -232,54 +378,50 @@ def web_app_rating(app_id, version):
 @blueprint.route('/<app_id>/<version>.json')
 def web_app_version_json(app_id, version):
     app = WebAppRating.entities.get(app_id=app_id)
-    try:
-        info = app.rating[version]
-    except KeyError:
-        version = "*"
-        try:
-            info = app.rating[version]
-        except KeyError:
-            info = {
-                "rating": "X",
-                "reason": None,
-                "link": None,
-            }
-    info["id"] = app.app_id
-    info["name"] = app.app_name
-    info["version"] = version
-    info["label"] = RATING_LABELS[info["rating"]]
-    return jsonify(**info)
+    etag = make_etag("version", app._id, app.modified, version)
+    response = not_modified(etag, app.modified)
+    if response:
+        return response
+    
+    version, info = select_stored_rating(app, version)
+    document = web_app_version_document(app.app_id, app.app_name, version, info)
+    return add_cache_headers(jsonify(**document), etag, app.modified)
 
-def send_pil_image(img, format, mimetype, **params):
-    buffer = BytesIO()
-    img.save(buffer, format, **params)
-    buffer.seek(0)
-    return send_file(buffer, mimetype=mimetype)
+def send_image_data(data, mimetype):
+    return send_file(BytesIO(data), mimetype=mimetype)
     
+def parse_badge_scale(version):
+    """Split the scale from '<version>@<scale>x' or the 'scale' query argument."""
+    match = BADGE_SCALE_REGEX.match(version)
+    if match:
+        version, scale = match.group(1), int(match.group(2))
+    else:
+        scale = request.args.get("scale", 1, type=int)
+    return version, min(max(scale, 1), MAX_BADGE_SCALE)
+
 @blueprint.route('/<app_id>/<version>.png')
 def web_app_version_png(app_id, version):
+    version, scale = parse_badge_scale(version)
     app = WebAppRating.entities.get(app_id=app_id)
-    info = None
-    if version == "latest":
-        version, info = get_latest_rating(app.rating)
-        if not info:
-            version = "*"
-    if not info:
-        try:
-            info = app.rating[version]
-        except KeyError:
-            version = "*"
-            try:
-                info = app.rating[version]
-            except KeyError:
-                info = None
+    # The encoding is part of the representation, so a new profile invalidates cached badges.
+    etag = make_etag("png", app._id, app.modified, version, scale, badge_profile(scale).name)
+    response = not_modified(etag, app.modified)
+    if response:
+        return response
     
-    rating = info["rating"] if info else "X"
-    variants = ["(%s) %s" % entry for entry in RATING_LABELS.items()]
-    label = RATING_LABELS[rating]
-    color = RATING_COLORS[rating]
-    img = easybadges.badge("Rating", "(%s) %s" % (rating, label), color=color, variants=variants)
-    return send_pil_image(img, "PNG", "image/png", compress_level=9)
+    rating = badge_rating(select_stored_rating(app, version, latest=True)[1])
+    return add_cache_headers(send_image_data(rating_badge_png(rating, scale), "image/png"), etag, app.modified)
+
+@blueprint.route('/<app_id>/<version>.svg')
+def web_app_version_svg(app_id, version):
+    app = WebAppRating.entities.get(app_id=app_id)
+    etag = make_etag("svg", app._id, app.modified, version)
+    response = not_modified(etag, app.modified)
+    if response:
+        return response
+    
+    rating = badge_rating(select_stored_rating(app, version, latest=True)[1])
+    return add_cache_headers(Response(rating_badge_svg(rating), mimetype="image/svg+xml"), etag, app.modified)
     
     
     
@@ -0,0 +1,135 @@
+"""Pre-generate the rating JSON documents and badges into a static tree.
+
+The layout mirrors the blueprint routes so the output directory can be
+served directly by a web server:
+
+    python3 -m rating.export OUTPUT_DIR [--db FILE] [--jobs N] [--force]
+
+Apps whose data did not change since the previous run are skipped, based
+on content hashes stored in the output directory.
+"""
+from multiprocessing import Pool
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import uorm.sqlite
+from rating.models import WebAppRating
+from rating.blueprint import (index_document, web_app_document, web_app_version_document,
+    load_app_ratings, select_app_rating, badge_rating, rating_badge_png, rating_badge_svg, rating_sprite)
+
+# Bump when the output format changes so every app gets regenerated.
+EXPORT_REVISION = 1
+MANIFEST = ".export.json"
+# Apps loaded per keyset page, so only plain data is kept for the whole catalog.
+LOAD_CHUNK_SIZE = 500
+
+
+
+def write_file(path, data):
+    """Write data atomically, so the file is never served half written."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_json(path, document):
+    write_file(path, json.dumps(document, sort_keys=True).encode("utf-8"))
+
+
+def app_hash(app):
+    data = json.dumps([EXPORT_REVISION, app.app_id, app.app_name, app.versions], sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def export_app(output, app):
+    app_dir = os.path.join(output, app.app_id)
+    write_json(os.path.join(output, app.app_id + ".json"), web_app_document(app))
+    written = set()
+    for version, info in app.versions + [("latest", None)]:
+        rating = badge_rating(select_app_rating(app, version, latest=True)[1])
+        document = web_app_version_document(app.app_id, app.app_name, *select_app_rating(app, version))
+        for name, data in (
+            (version + ".json", json.dumps(document, sort_keys=True).encode("utf-8")),
+            (version + ".png", rating_badge_png(rating)),
+            (version + ".svg", rating_badge_svg(rating).encode("utf-8"))):
+            write_file(os.path.join(app_dir, name), data)
+            written.add(name)
+    for name in os.listdir(app_dir):
+        if name not in written:
+            os.unlink(os.path.join(app_dir, name))
+    return app.app_id
+
+
+def export_app_job(job):
+    return export_app(*job)
+
+
+def remove_app(output, app_id):
+    try:
+        os.unlink(os.path.join(output, app_id + ".json"))
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(os.path.join(output, app_id), ignore_errors=True)
+
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def export(output, jobs=None, force=False):
+    """Export all apps; returns the ids of apps that have been regenerated."""
+    query = WebAppRating.entities.query(order_by="app_name")
+    apps = load_app_ratings(app for chunk in query.iter_chunks(LOAD_CHUNK_SIZE) for app in chunk)
+    old_hashes = {} if force else load_manifest(output)
+    hashes = {app.app_id: app_hash(app) for app in apps}
+    changed = [app for app in apps if old_hashes.get(app.app_id) != hashes[app.app_id]]
+
+    os.makedirs(output, exist_ok=True)
+    with Pool(jobs) as pool:
+        updated = pool.map(export_app_job, [(output, app) for app in changed])
+    for app_id in old_hashes:
+        if app_id not in hashes:
+            remove_app(output, app_id)
+
+    write_json(os.path.join(output, "index.json"), index_document(apps))
+    write_file(os.path.join(output, "ratings.png"), rating_sprite().data)
+    write_json(os.path.join(output, MANIFEST), hashes)
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate rating JSON documents and badges.")
+    parser.add_argument("output", help="output directory")
+    parser.add_argument("--db", help="SQLite database file (default: derived from config.PROJECT_ID)")
+    parser.add_argument("--namespace", default="nuvola", help="database namespace")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="regenerate all apps")
+    args = parser.parse_args(argv)
+
+    db_file = args.db
+    if not db_file:
+        import config
+        db_file = config.PROJECT_ID + ".sqlite"
+    uorm.sqlite.connect(db_file, namespace=args.namespace)
+    updated = export(args.output, args.jobs, args.force)
+    print("%d apps regenerated." % len(updated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Move per-version ratings from the WebAppRating.rating blob to VersionRating rows.
+
+    python3 -m rating.migrate [--db FILE] [--namespace NAMESPACE]
+
+Run it once after upgrading and before serving: the application reads only
+VersionRating rows, and migrating scans every app, so it does not run at
+startup. It is idempotent: versions that already have a row are left alone
+and migrated blobs are emptied, so an interrupted run is completed by the
+next one.
+"""
+import argparse
+
+import uorm.sqlite
+from rating.models import WebAppRating, VersionRating, version_key
+
+
+def migrate_ratings():
+    """Migrate apps with a non-empty rating blob; returns the number of migrated apps."""
+    apps = [app for app in WebAppRating.entities.query() if app.rating]
+    if not apps:
+        return 0
+    existing = VersionRating.for_apps()
+    rows = []
+    for app in apps:
+        versions = set(version_rating.version for version_rating in existing.get(app._id, ()))
+        for version, info in app.rating.items():
+            if version not in versions:
+                rows.append(VersionRating(app=app._id, version=version, version_key=version_key(version),
+                    rating=info["rating"], reason=info.get("reason", ""), link=info.get("link")))
+        # The rows define the versions now; modified is bumped, so cached documents are revalidated.
+        app.rating = {}
+    VersionRating.entities.bulk_create(rows)
+    WebAppRating.entities.bulk_save(apps)
+    return len(apps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move per-version ratings to their own table.")
+    parser.add_argument("--db", help="SQLite database file (default: derived from config.PROJECT_ID)")
+    parser.add_argument("--namespace", default="nuvola", help="database namespace")
+    args = parser.parse_args(argv)
+
+    db_file = args.db
+    if not db_file:
+        import config
+        db_file = config.PROJECT_ID + ".sqlite"
+    uorm.sqlite.connect(db_file, namespace=args.namespace)
+    print("%d apps migrated." % migrate_ratings())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,99 @@
 import uorm as orm
 import json
 
+# Bits per numeric component of version_key().
+VERSION_PART_BITS = 21
+VERSION_PARTS = 3
+
+def version_key(version):
+    """Integer ordering versions like their numeric components, e.g. 1.10 after 1.9.
+
+    Up to three components below 2**21 are significant. Versions that are not numeric,
+    like the "*" wildcard, get -1 and sort before all others."""
+    try:
+        parts = [int(i) for i in version.split(".")]
+    except ValueError:
+        return -1
+    if len(parts) > VERSION_PARTS or any(i < 0 for i in parts):
+        return -1
+    key = 0
+    limit = (1 << VERSION_PART_BITS) - 1
+    for i in parts + [0] * (VERSION_PARTS - len(parts)):
+        key = (key << VERSION_PART_BITS) | min(i, limit)
+    return key
+
 class WebAppRating(orm.Entity):
     app_id = orm.String(index=True, unique=True)
     app_name = orm.String(unique=True)
+    # Legacy map of versions to ratings, moved to VersionRating by rating.migrate and kept empty.
     rating = orm.Json()
-    
+    modified = orm.Timestamp(auto_now=True, empty=True, index=True)
+
+    def touch(self):
+        """Save the app with a new modification time, e.g. after its versions have changed."""
+        self.modified = orm.Timestamp.now()
+        self.save()
+
+class VersionRating(orm.Entity):
+    """Rating of a single version of a web app."""
+    # _id of the WebAppRating; the index serves latest version lookups.
+    app = orm.Integer(index=("-version_key",))
+    # A version is rated once per app.
+    version = orm.String(index=("app",), unique_index=True)
+    version_key = orm.Integer()
+    rating = orm.String()
+    reason = orm.String(empty=True)
+    link = orm.String(empty=True)
+
+    def info(self):
+        return {"rating": self.rating, "reason": self.reason, "link": self.link}
+
+    @classmethod
+    def get_version(cls, app, version):
+        """Return the rating of a version of an app, or None."""
+        try:
+            return cls.entities.get(app=app._id, version=version)
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def get_latest(cls, app):
+        """Return the rating of the highest version of an app, or None."""
+        for version_rating in cls.entities.query(filter_by=[("app", "=", app._id)], order_by="-version_key",
+            limit=1):
+            return version_rating
+        return None
+
+    @classmethod
+    def for_app(cls, app):
+        """Return ratings of all versions of an app, latest first."""
+        return list(cls.entities.query(filter_by=[("app", "=", app._id)], order_by="-version_key"))
+
+    @classmethod
+    def for_apps(cls):
+        """Return a map of app _id to ratings of all its versions, latest first, from a single query."""
+        versions = {}
+        for version_rating in cls.entities.query(order_by=["app", "-version_key"]):
+            versions.setdefault(version_rating.app, []).append(version_rating)
+        return versions
+
+    @classmethod
+    def set_version(cls, app, version, rating, reason, link, replace=None):
+        """Create or update the rating of a version, optionally replacing another version."""
+        if replace is not None and replace != version:
+            cls.entities.delete_by(filter_by=[("app", "=", app._id), ("version", "=", replace)])
+        version_rating = cls.get_version(app, version)
+        if version_rating is None:
+            version_rating = cls(app=app._id, version=version, version_key=version_key(version))
+        version_rating.rating = rating
+        version_rating.reason = reason
+        version_rating.link = link
+        version_rating.save()
+        app.touch()
+        return version_rating
+
+    @classmethod
+    def delete_versions(cls, app, versions):
+        count = cls.entities.delete_by(filter_by=[("app", "=", app._id), ("version", "in", list(versions))])
+        app.touch()
+        return count
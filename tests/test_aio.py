@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import unittest
+
+from uorm import aio
+from tests.test_sqlite import SqliteTestCase, Item, Other
+
+
+class AsyncTest(SqliteTestCase):
+    def tearDown(self):
+        aio.shutdown(self.db)
+        super().tearDown()
+
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_entity_manager(self):
+        async def scenario():
+            item = await Item.entities.acreate(name="a", size=1)
+            self.assertEqual(item._id, 1)
+            loaded = await Item.entities.aget(_id=item._id)
+            self.assertEqual((loaded.name, loaded.size), ("a", 1))
+            loaded.size = 2
+            self.assertTrue(await loaded.asave())
+            self.assertFalse(await Item.entities.asave(loaded))
+            await Item.entities.abulk_create([Item(name="b", size=2), Item(name="c", size=3)])
+            self.assertEqual(await Item.entities.acount(), 3)
+            self.assertEqual(await Item.entities.acount(size=2), 2)
+            self.assertTrue(await Item.entities.aexists(name="c"))
+            self.assertFalse(await Item.entities.aexists(name="d"))
+            with self.assertRaises(Item.DoesNotExist):
+                await Item.entities.aget(name="d")
+            self.assertEqual(await Item.entities.adelete_by(size=2), 2)
+            return [item.name for item in await Item.entities.aall()]
+        self.assertEqual(self.run_async(scenario()), ["c"])
+
+    def test_query(self):
+        Item.entities.bulk_create([Item(name="item%02d" % i, size=i % 4) for i in range(25)])
+        Other.entities.bulk_create([Other(name="other%d" % i, size=i) for i in range(5)])
+        async def scenario():
+            query = Item.entities.query(order_by="-size", batch_size=4)
+            names = [item.name async for item in query]
+            other = [item.name async for item in Other.entities.query(batch_size=2)]
+            values = [value async for value in Item.entities.query(order_by="name").values_list("name", flat=True)]
+            count = await Item.entities.query(filter_by=[("size", "=", 0)]).acount()
+            exists = await Item.entities.query(filter_by=[("size", ">", 3)]).aexists()
+            one = await Item.entities.query(filter_by=[("name", "=", "item07")]).aone()
+            return names, other, values, count, exists, one
+        names, other, values, count, exists, one = self.run_async(scenario())
+        expected = [item.name for item in Item.entities.query(order_by=["-size", "_id"])]
+        self.assertEqual(names, expected)
+        self.assertEqual(other, ["other%d" % i for i in range(5)])
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(values), 25)
+        self.assertEqual((count, exists, one.name), (7, False, "item07"))
+
+    def test_runs_in_executor(self):
+        async def scenario():
+            return await aio.run(self.db, threading.current_thread)
+        thread = self.run_async(scenario())
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertTrue(thread.name.startswith("uorm"))
+
+
+if __name__ == '__main__':
+    unittest.main()
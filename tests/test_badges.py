@@ -0,0 +1,112 @@
+import math
+import unittest
+
+from PIL import Image
+
+from easybadges.Badges import Background, CornerMask
+from easybadges.Cache import BadgeCache
+
+
+def reference_background(w, h, s, r, left, right):
+	"""The per-pixel rasterizer Background() replaced."""
+	img = Image.new('RGBA', (w, h))
+	px = img.load()
+
+	def mulAlpha(px, i, j, a):
+		px[i, j] = (px[i, j][0], px[i, j][1], px[i, j][2], round(px[i, j][3] * a))
+
+	def blendColor(px, i, j, c, f):
+		r = round(c[0] * f + px[i, j][0] * (1 - f))
+		g = round(c[1] * f + px[i, j][1] * (1 - f))
+		b = round(c[2] * f + px[i, j][2] * (1 - f))
+		px[i, j] = (r, g, b, px[i, j][3])
+
+	for i in range(s):
+		for j in range(h):
+			px[i, j] = left
+
+	for i in range(s, w):
+		for j in range(h):
+			px[i, j] = right
+
+	for i in range(r):
+		for j in range(r):
+			cx = r - 1
+			cy = r - 1
+			a = 1 - min(max(math.sqrt((i - cx) ** 2 + (j - cy) ** 2) - r + 1, 0), 1)
+			mulAlpha(px, i, j, a)
+			mulAlpha(px, w - i - 1, j, a)
+			mulAlpha(px, i, h - j - 1, a)
+			mulAlpha(px, w - i - 1, h - j - 1, a)
+
+	for i in range(w):
+		for j in range(h):
+			grad = (
+				round(0xB8 * (1 - j / (h - 1))),
+				round(0xB8 * (1 - j / (h - 1))),
+				round(0xB8 * (1 - j / (h - 1))),
+			)
+			blendColor(px, i, j, grad, 0.15)
+	return img
+
+
+class BackgroundTest(unittest.TestCase):
+	SIZES = ((90, 22, 40), (61, 20, 29), (212, 44, 80), (8, 8, 4), (30, 3, 0))
+	COLORS = (
+		((0x58, 0x58, 0x58, 0xFF), (0x00, 0x7E, 0xC6, 0xFF)),
+		((0x58, 0x58, 0x58, 0xFF), (0x4C, 0xC6, 0x1E, 0xFF)),
+		((0x00, 0x00, 0x00, 0xFF), (0xFF, 0xFF, 0xFF, 0xFF)),
+		((0xFF, 0x01, 0x80, 0xFF), (0x7F, 0xFE, 0x00, 0xFF)),
+	)
+
+	def radii(self, h):
+		# Radius 0, the usual ones, half the height and the whole height, where corners overlap.
+		return sorted(set(r for r in (0, 1, 4, 8, h // 2, (h + 1) // 2, h) if r <= h))
+
+	def test_matches_per_pixel_rendering(self):
+		for w, h, s in self.SIZES:
+			for r in self.radii(h):
+				for left, right in self.COLORS:
+					with self.subTest(w=w, h=h, s=s, r=r, left=left, right=right):
+						img = Background(w, h, s, r, left, right)
+						self.assertEqual(img.mode, 'RGBA')
+						self.assertEqual(img.size, (w, h))
+						self.assertEqual(img.tobytes(), reference_background(w, h, s, r, left, right).tobytes())
+
+	def test_corner_mask(self):
+		for w, h, s in self.SIZES:
+			for r in self.radii(h):
+				with self.subTest(w=w, h=h, r=r):
+					alpha = reference_background(w, h, s, r, (0, 0, 0, 0xFF), (0, 0, 0, 0xFF)).getchannel('A')
+					self.assertEqual(CornerMask(w, h, r).tobytes(), alpha.tobytes())
+
+
+
+class BadgeCacheTest(unittest.TestCase):
+	def test_lru_eviction(self):
+		cache = BadgeCache(size=2)
+		a = cache.get('A', '1')
+		cache.get('B', '2')
+		# Using A makes B the least recently used entry.
+		self.assertIs(cache.get('A', '1'), a)
+		cache.get('C', '3')
+		self.assertEqual(len(cache), 2)
+		keys = [key[:2] for key in cache.entries]
+		self.assertEqual(keys, [('A', '1'), ('C', '3')])
+		self.assertIs(cache.get('A', '1'), a)
+		self.assertIsNot(cache.get('B', '2'), None)
+		self.assertEqual([key[:2] for key in cache.entries], [('A', '1'), ('B', '2')])
+
+	def test_key_includes_arguments(self):
+		cache = BadgeCache(size=8)
+		plain = cache.get('A', '1')
+		self.assertIsNot(cache.get('A', '1', color=(1, 2, 3)), plain)
+		self.assertIsNot(cache.get('A', '1', profile='fast'), plain)
+		self.assertIsNot(cache.get('A', '1', scale=2), plain)
+		self.assertEqual(len(cache), 4)
+		cache.clear()
+		self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,270 @@
+import importlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+from PIL import Image
+
+import rating
+import uauth
+import uorm.sqlite
+from uorm.audit import PlanAudit
+from uorm.default import get_default_db, set_default_db
+from rating.export import export
+from rating.migrate import migrate_ratings
+from rating.models import WebAppRating, VersionRating
+
+# rating.blueprint is the Blueprint itself; the module holds the helpers.
+views = importlib.import_module("rating.blueprint")
+
+# Schema of databases created before per-version ratings and modification times.
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "nuvola_WebAppRating" (
+ _id INTEGER PRIMARY KEY AUTOINCREMENT,
+ app_id TEXT UNIQUE NOT NULL,
+ app_name TEXT UNIQUE NOT NULL,
+ rating BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "nuvola_WebAppRating_app_id_index" ON "nuvola_WebAppRating" ("app_id");
+"""
+
+
+class RatingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, "test.sqlite")
+        self.previous_db = get_default_db()
+        self.connect()
+        self.app = Flask(__name__)
+        self.app.secret_key = "test"
+        self.app.register_blueprint(rating.blueprint)
+        self.app.register_blueprint(uauth.blueprint)
+        self.client = self.app.test_client()
+
+    def connect(self):
+        self.db = uorm.sqlite.Connection(self.db_file, "nuvola")
+        set_default_db(self.db)
+
+    def tearDown(self):
+        set_default_db(self.previous_db)
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def create_app(self, app_id, versions):
+        app = WebAppRating.entities.create(app_id=app_id, app_name=app_id.title(), rating={})
+        for version, value in versions:
+            VersionRating.set_version(app, version, value, "", "")
+        return app
+
+
+class BaselineSchemaTestCase(RatingTestCase):
+    """Opens a database created with the baseline schema, holding legacy rating blobs."""
+    apps = {
+        "foo": {"1.9": {"rating": "B", "reason": "", "link": None},
+            "1.10": {"rating": "A", "reason": "fixed", "link": "https://example.com"},
+            "*": {"rating": "D", "reason": "other", "link": None}},
+        "bar": {"*": {"rating": "C", "reason": "any", "link": None}},
+    }
+
+    def connect(self):
+        if not os.path.exists(self.db_file):
+            conn = sqlite3.connect(self.db_file)
+            with conn:
+                conn.executescript(BASELINE_SCHEMA)
+                conn.executemany('INSERT INTO "nuvola_WebAppRating" (app_id, app_name, rating) VALUES (?, ?, ?)',
+                    [(app_id, app_id.title(), json.dumps(versions)) for app_id, versions in self.apps.items()])
+            conn.close()
+        super().connect()
+
+
+class BaselineSchemaTest(BaselineSchemaTestCase):
+    def test_upgrade(self):
+        with self.db.conn as conn:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()["integrity_check"], "ok")
+            indexes = [row["name"] for row in conn.execute('PRAGMA index_list("nuvola_WebAppRating")')]
+            columns = [row["name"] for row in conn.execute(
+                'PRAGMA index_info("nuvola_WebAppRating_modified_index")')]
+        self.assertIn("nuvola_WebAppRating_modified_index", indexes)
+        self.assertEqual(columns, ["modified"])
+        response = self.client.get("/index.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(app["id"] for app in response.get_json()["apps"]), ["bar", "foo"])
+
+
+class MigrationTest(BaselineSchemaTestCase):
+    def versions(self, app_id):
+        app = WebAppRating.entities.get(app_id=app_id)
+        return [(r.version, r.info()) for r in VersionRating.for_app(app)]
+
+    def test_migrate(self):
+        self.assertEqual(migrate_ratings(), 2)
+        foo_versions = self.apps["foo"]
+        self.assertEqual(self.versions("foo"),
+            [(version, foo_versions[version]) for version in ("1.10", "1.9", "*")])
+        self.assertEqual(self.versions("bar"), [("*", self.apps["bar"]["*"])])
+        for app in WebAppRating.entities.query():
+            self.assertEqual(app.rating, {})
+            self.assertIsNotNone(app.modified)
+
+        foo = WebAppRating.entities.get(app_id="foo")
+        bar = WebAppRating.entities.get(app_id="bar")
+        self.assertEqual(VersionRating.get_latest(foo).version, "1.10")
+        self.assertEqual(VersionRating.get_latest(bar).version, "*")
+        self.assertEqual(views.select_stored_rating(foo, "latest", latest=True), ("1.10", foo_versions["1.10"]))
+        self.assertEqual(views.select_stored_rating(foo, "2.0"), ("*", foo_versions["*"]))
+        self.assertEqual(views.select_stored_rating(bar, "latest", latest=True), ("*", self.apps["bar"]["*"]))
+        response = self.client.get("/foo/2.0.json")
+        self.assertEqual((response.get_json()["version"], response.get_json()["rating"]), ("*", "D"))
+
+    def test_idempotent(self):
+        self.assertEqual(migrate_ratings(), 2)
+        self.assertEqual(migrate_ratings(), 0)
+        self.assertEqual(VersionRating.entities.count(), 4)
+        # A run interrupted after creating the rows leaves blobs behind; the next one only empties them.
+        foo = WebAppRating.entities.get(app_id="foo")
+        foo.rating = self.apps["foo"]
+        foo.save()
+        self.assertEqual(migrate_ratings(), 1)
+        self.assertEqual(VersionRating.entities.count(), 4)
+        self.assertEqual(WebAppRating.entities.get(app_id="foo").rating, {})
+
+
+class ConditionalGetTest(RatingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_app("foo", [("1.0", "A"), ("2.0", "C")])
+
+    def assertRevalidated(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_not_modified(self):
+        for url in ("/index.json", "/foo.json", "/foo/1.0.json", "/foo/latest.png", "/foo/1.0.svg"):
+            with self.subTest(url=url):
+                self.assertRevalidated(url)
+
+    def test_sprite(self):
+        response = self.client.get("/ratings.png")
+        response = self.client.get("/ratings.png", headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_version_invalidates(self):
+        etag = self.assertRevalidated("/foo/latest.png")
+        app = WebAppRating.entities.get(app_id="foo")
+        VersionRating.set_version(app, "3.0", "F", "", "")
+        response = self.client.get("/foo/latest.png", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_profile_in_png_etag(self):
+        etag = self.assertRevalidated("/foo/latest.png")
+        self.addCleanup(rating.set_badge_profile, views.RATING_BADGE_PROFILE)
+        rating.set_badge_profile("palette")
+        response = self.client.get("/foo/latest.png", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+
+class BadgeScaleTest(RatingTestCase):
+    def size(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return Image.open(io.BytesIO(response.data)).size
+
+    def test_scale(self):
+        self.create_app("foo", [("1.0", "A")])
+        w, h = self.size("/foo/1.0.png")
+        # Badges are rendered natively at the scale, so sizes are only close to a multiple.
+        for url, scale in (("/foo/1.0@2x.png", 2), ("/foo/1.0.png?scale=3", 3), ("/foo/latest@4x.png", 4)):
+            with self.subTest(url=url):
+                scaled = self.size(url)
+                self.assertAlmostEqual(scaled[0], w * scale, delta=2 * scale)
+                self.assertEqual(scaled[1], h * scale)
+
+    def test_scale_clamped(self):
+        self.create_app("foo", [("1.0", "A")])
+        self.assertEqual(self.size("/foo/1.0@9x.png"), self.size("/foo/1.0@4x.png"))
+        self.assertEqual(self.size("/foo/1.0.png?scale=100"), self.size("/foo/1.0@4x.png"))
+        self.assertEqual(self.size("/foo/1.0.png?scale=0"), self.size("/foo/1.0.png"))
+        self.assertEqual(self.size("/foo/1.0.png?scale=-2"), self.size("/foo/1.0.png"))
+        self.assertEqual(self.size("/foo/1.0@1x.png"), self.size("/foo/1.0.png"))
+
+
+class VersionRatingTest(RatingTestCase):
+    def test_unique_version(self):
+        foo = self.create_app("foo", [("1.0", "A")])
+        bar = self.create_app("bar", [("1.0", "B")])
+        with self.assertRaises(sqlite3.IntegrityError):
+            VersionRating.entities.create(app=foo._id, version="1.0", version_key=0, rating="C", reason="")
+        VersionRating.set_version(foo, "1.0", "C", "", "")
+        self.assertEqual([(v.version, v.rating) for v in VersionRating.for_app(foo)], [("1.0", "C")])
+        self.assertEqual(VersionRating.get_version(bar, "1.0").rating, "B")
+
+
+class QueryPlanTest(RatingTestCase):
+    def test_queries_use_indexes(self):
+        foo = self.create_app("foo", [("1.0", "A"), ("2.0", "C")])
+        self.create_app("bar", [("*", "B")])
+        audit = PlanAudit()
+        self.db.enable_plan_audit(audit)
+        self.addCleanup(self.db.enable_plan_audit, None)
+
+        with self.client.session_transaction() as session:
+            session["user"] = "tester"
+        for url in ("/", "/index.json", "/foo/", "/foo/?edit_version=1.0", "/foo.json", "/foo/1.0.json",
+            "/foo/latest.json", "/bar/3.0.png", "/foo/latest@2x.svg"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post("/foo/", data={"rating_version": "2.0", "rating_rating": "B",
+            "rating_reason": "", "rating_link": "", "edit_version": "2.0"})
+        self.assertLess(response.status_code, 400)
+        VersionRating.set_version(foo, "3.0", "D", "", "", replace="1.0")
+        bar = WebAppRating.entities.get(app_id="bar")
+        self.assertEqual(sorted(VersionRating.for_apps()), sorted([foo._id, bar._id]))
+        query = WebAppRating.entities.query(order_by="app_name")
+        self.assertEqual([len(chunk) for chunk in query.iter_chunks(1)], [1, 1])
+        query = VersionRating.entities.query(filter_by=[("app", "=", foo._id)], order_by="-version_key")
+        self.assertEqual([len(chunk) for chunk in query.iter_chunks(1)], [1, 1])
+
+        self.assertTrue(audit.report())
+        audit.check()
+
+
+class ExportTest(RatingTestCase):
+    def test_skip_unchanged_apps(self):
+        foo = self.create_app("foo", [("1.0", "A")])
+        self.create_app("bar", [("2.0", "B")])
+        output = os.path.join(self.directory, "export")
+        self.assertEqual(sorted(export(output, jobs=1)), ["bar", "foo"])
+        with open(os.path.join(output, "foo", "1.0.json")) as f:
+            self.assertIn('"rating": "A"', f.read())
+
+        self.assertEqual(export(output, jobs=1), [])
+        VersionRating.set_version(foo, "1.1", "C", "", "")
+        self.assertEqual(export(output, jobs=1), ["foo"])
+        self.assertTrue(os.path.exists(os.path.join(output, "foo", "1.1.png")))
+        self.assertEqual(sorted(export(output, jobs=1, force=True)), ["bar", "foo"])
+
+        WebAppRating.entities.delete_by(app_id="bar")
+        self.assertEqual(export(output, jobs=1), [])
+        self.assertFalse(os.path.exists(os.path.join(output, "bar")))
+        self.assertFalse(os.path.exists(os.path.join(output, "bar.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
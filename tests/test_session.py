@@ -0,0 +1,134 @@
+import unittest
+
+from flask import Flask
+
+import uorm as orm
+from uorm import instrumentation, session
+from tests.test_sqlite import SqliteTestCase, StatementLog
+
+
+class Account(orm.Entity):
+    email = orm.String(unique=True)
+    name = orm.String()
+
+
+class SessionTestCase(SqliteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = Account.entities.create(email="alice@example.com", name="Alice")
+        self.log = instrumentation.add_hook(StatementLog())
+        self.addCleanup(instrumentation.remove_hook, self.log)
+        self.addCleanup(session.end, commit=False)
+
+
+class IdentityMapTest(SessionTestCase):
+    def test_same_instance(self):
+        with session.scope():
+            first = Account.entities.get(_id=self.alice._id)
+            self.assertIs(Account.entities.get(_id=self.alice._id), first)
+            self.assertIs(Account.entities.get(email="alice@example.com"), first)
+            self.assertIs(list(Account.entities.query())[0], first)
+            self.assertTrue(Account.entities.exists(email="alice@example.com"))
+        # Only the first get() and the query reached the database.
+        self.assertEqual(len(self.log.statements), 2)
+
+    def test_lookup(self):
+        with session.scope() as current:
+            self.assertEqual(current.lookup(Account, {"email": "alice@example.com"}), (False, None))
+            alice = Account.entities.get(email="alice@example.com")
+            self.assertEqual(current.lookup(Account, {"email": "alice@example.com"}), (True, alice))
+            self.assertEqual(current.lookup(Account, {"_id": alice._id, "name": "Alice"}), (True, alice))
+            # Only _id and unique fields are answered from memory.
+            self.assertEqual(current.lookup(Account, {"name": "Alice"}), (False, None))
+
+    def test_missing(self):
+        with session.scope() as current:
+            with self.assertRaises(Account.DoesNotExist):
+                Account.entities.get(email="bob@example.com")
+            count = len(self.log.statements)
+            self.assertEqual(current.lookup(Account, {"email": "bob@example.com"}), (True, None))
+            with self.assertRaises(Account.DoesNotExist):
+                Account.entities.get(email="bob@example.com")
+            self.assertFalse(Account.entities.exists(email="bob@example.com"))
+            self.assertEqual(len(self.log.statements), count)
+            # Saving an entity of the kind invalidates what is known to be missing.
+            Account(email="bob@example.com", name="Bob").save()
+            self.assertEqual(Account.entities.get(email="bob@example.com").name, "Bob")
+
+    def test_outside_session(self):
+        first = Account.entities.get(_id=self.alice._id)
+        self.assertIsNot(Account.entities.get(_id=self.alice._id), first)
+        self.assertIsNone(session.current())
+
+
+class DeferredSaveTest(SessionTestCase):
+    def test_flush_on_end(self):
+        with session.scope() as current:
+            alice = Account.entities.get(_id=self.alice._id)
+            alice.name = "Alice Liddell"
+            bob = Account(email="bob@example.com", name="Bob")
+            bob.save()
+            bob.save()
+            Account.entities.bulk_save([alice, bob, alice])
+            self.assertEqual(len(current.pending), 2)
+            self.assertIsNone(bob._id)
+            writes = [sql for sql in self.log.statements if not sql.startswith("SELECT")]
+            self.assertEqual(writes, [])
+        self.assertIsNotNone(bob._id)
+        self.assertEqual(Account.entities.get(_id=self.alice._id).name, "Alice Liddell")
+        self.assertEqual(Account.entities.count(), 2)
+
+    def test_flush_before_query(self):
+        with session.scope():
+            Account(email="bob@example.com", name="Bob").save()
+            self.assertEqual(Account.entities.count(), 2)
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with session.scope():
+                Account(email="bob@example.com", name="Bob").save()
+                raise RuntimeError()
+        session.begin()
+        Account(email="carol@example.com", name="Carol").save()
+        session.end(commit=False)
+        self.assertEqual(Account.entities.count(), 1)
+
+    def test_partial_entities(self):
+        with session.scope() as current:
+            alice = list(Account.entities.query().only("name"))[0]
+            self.assertIsNot(alice, Account.entities.get(_id=self.alice._id))
+            alice.name = "Changed"
+            self.assertRaises(ValueError, alice.save)
+            self.assertRaises(ValueError, Account.entities.bulk_save, [alice])
+            self.assertEqual(current.pending, {})
+
+
+class FlaskTest(SessionTestCase):
+    def setUp(self):
+        super().setUp()
+        app = Flask(__name__)
+        session.init_app(app)
+
+        @app.route("/<name>/<int:status>")
+        def create(name, status):
+            Account(email=name + "@example.com", name=name).save()
+            if status == 0:
+                raise RuntimeError("failed")
+            return name, status
+
+        self.client = app.test_client()
+
+    def test_commit(self):
+        self.assertEqual(self.client.get("/bob/200").status_code, 200)
+        self.assertEqual(Account.entities.get(email="bob@example.com").name, "bob")
+        self.assertIsNone(session.current())
+
+    def test_failed_requests_are_discarded(self):
+        self.assertEqual(self.client.get("/bob/404").status_code, 404)
+        self.assertEqual(self.client.get("/carol/0").status_code, 500)
+        self.assertEqual(Account.entities.count(), 1)
+        self.assertIsNone(session.current())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,350 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import uorm as orm
+import uorm.entity
+import uorm.sqlite
+from uorm import fields, instrumentation
+from uorm.default import get_default_db, set_default_db
+
+
+class Item(orm.Entity):
+    name = orm.String(index=True)
+    size = orm.Integer()
+    rank = orm.Integer(empty=True)
+
+
+class Document(orm.Entity):
+    data = orm.Json()
+    title = orm.String(empty=True)
+
+
+class Other(orm.Entity):
+    name = orm.String()
+    size = orm.Integer()
+
+
+class Pair(orm.Entity):
+    first = orm.String(index=("second",), unique_index=True)
+    second = orm.String()
+
+
+class StatementLog(instrumentation.Hook):
+    def __init__(self):
+        self.statements = []
+
+    def after(self, event):
+        self.statements.append(event.statement)
+
+
+class SqliteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.previous_db = get_default_db()
+        self.db = uorm.sqlite.Connection(os.path.join(self.directory, "test.sqlite"), "test")
+        set_default_db(self.db)
+
+    def tearDown(self):
+        set_default_db(self.previous_db)
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+
+class EntityTest(SqliteTestCase):
+    def test_field_access(self):
+        item = Item(name="a")
+        self.assertIsInstance(Item.name, orm.String)
+        self.assertEqual(item.name, "a")
+        self.assertIsNone(item.size)
+        self.assertIsNone(item._id)
+        self.assertFalse(hasattr(item, "__dict__"))
+        with self.assertRaises(AttributeError):
+            item.unknown = 1
+        self.assertEqual(item._as_data(), {"name": "a", "size": None, "rank": None})
+
+    def test_modification(self):
+        item = Item.entities.create(name="a", size=1)
+        self.assertFalse(item._is_new())
+        self.assertFalse(item._is_modified())
+        item.size = 1
+        self.assertFalse(item._is_modified())
+        item.size = 2
+        self.assertTrue(item._is_modified())
+        item.save()
+        loaded = Item.entities.get(_id=item._id)
+        self.assertEqual((loaded._id, loaded.name, loaded.size, loaded.rank), (item._id, "a", 2, None))
+        self.assertFalse(loaded._is_modified())
+        self.assertIn("'name': 'a'", repr(loaded))
+
+    def test_instances_do_not_share_values(self):
+        first = Item(name="a", size=1)
+        second = Item(name="b")
+        self.assertEqual((first.name, first.size), ("a", 1))
+        self.assertEqual((second.name, second.size), ("b", None))
+
+
+class BulkTest(SqliteTestCase):
+    def test_bulk_save_assigns_ids(self):
+        existing = Item.entities.create(name="existing", size=1)
+        existing.size = 2
+        new = [Item(name="new%d" % i, size=i) for i in range(5)]
+        Item.entities.bulk_save([new[0], existing] + new[1:])
+        ids = [item._id for item in new]
+        self.assertEqual(ids, list(range(existing._id + 1, existing._id + 6)))
+        for item in new:
+            self.assertEqual(Item.entities.get(_id=item._id).name, item.name)
+        self.assertEqual(Item.entities.get(_id=existing._id).size, 2)
+        # Saved entities are updated rather than inserted again.
+        new[0].size = 10
+        Item.entities.bulk_save(new)
+        self.assertEqual(len(list(Item.entities.query())), 6)
+        self.assertEqual(Item.entities.get(_id=new[0]._id).size, 10)
+
+    def test_bulk_create(self):
+        items = Item.entities.bulk_create([Item(name="a", size=1), {"name": "b", "size": 2}])
+        self.assertEqual([item._id for item in items], [1, 2])
+        self.assertEqual([(item.name, item.size) for item in Item.entities.query(order_by="_id")],
+            [("a", 1), ("b", 2)])
+        self.assertEqual(Item.entities.bulk_save(items), 0)
+
+
+class InFilterTest(SqliteTestCase):
+    def test_duplicate_values_across_chunks(self):
+        items = [Item(name="item%04d" % i, size=i) for i in range(uorm.sqlite.MAX_IN_VALUES + 10)]
+        Item.entities.bulk_create(items)
+        ids = [item._id for item in items]
+        # The duplicate of the first id lands in the second chunk.
+        values = ids[:uorm.sqlite.MAX_IN_VALUES] + ids[:1] + ids[uorm.sqlite.MAX_IN_VALUES:]
+        self.assertEqual(len(uorm.sqlite.chunk_filters([("_id", "in", values)])), 2)
+
+        result = [item._id for item in Item.entities.query(filter_by=[("_id", "in", values)], order_by="_id").all()]
+        self.assertEqual(result, ids)
+        names = [item.name for item in Item.entities.query(filter_by=[("name", "in", ["item0000"] * 600)]).all()]
+        self.assertEqual(names, ["item0000"])
+        self.assertEqual(Item.entities.delete_by(filter_by=[("_id", "in", values)]), len(ids))
+
+    def test_order_chunks_with_nulls(self):
+        count = uorm.sqlite.MAX_IN_VALUES + 10
+        items = Item.entities.bulk_create([Item(name="item%04d" % i, size=i, rank=i % 7 if i % 3 else None)
+            for i in range(count)])
+        ids = [item._id for item in items]
+        for order_by in (["rank", "_id"], ["-rank", "_id"], ["rank", "-size"]):
+            with self.subTest(order_by=order_by):
+                # A single statement is ordered by SQLite, chunks are sorted in Python.
+                expected = [item._id for item in Item.entities.query(order_by=order_by)]
+                result = [item._id for item in Item.entities.query(filter_by=[("_id", "in", ids)], order_by=order_by)]
+                self.assertEqual(result, expected)
+
+
+
+class LazyJsonTest(SqliteTestCase):
+    def test_written_back_without_serialization(self):
+        document = Document.entities.create(data={"versions": list(range(100))}, title="a")
+        raw = Document.entities.get(_id=document._id)._as_data()["data"]
+        document = Document.entities.get(_id=document._id)
+        self.assertIsInstance(Document.data.slot.__get__(document), fields.Lazy)
+        log = instrumentation.add_hook(StatementLog())
+        self.addCleanup(instrumentation.remove_hook, log)
+        with mock.patch.object(fields.Json, "serialize", side_effect=AssertionError("serialized")), \
+                mock.patch.object(fields.Json, "deserialize", side_effect=AssertionError("deserialized")):
+            self.assertEqual(document._as_data()["data"], raw)
+            document.title = "b"
+            self.assertTrue(document.save())
+        self.assertNotIn('"data"', log.statements[-1])
+        self.assertIsInstance(Document.data.slot.__get__(document), fields.Lazy)
+        self.assertEqual(Document.entities.bulk_save([document]), 0)
+        document = Document.entities.get(_id=document._id)
+        self.assertEqual(document.title, "b")
+        self.assertEqual(document.data, {"versions": list(range(100))})
+
+
+class ProjectionTest(SqliteTestCase):
+    def test_projection_over_chunks(self):
+        count = uorm.sqlite.MAX_IN_VALUES + 10
+        items = Item.entities.bulk_create([Item(name="item%04d" % i, size=count - i) for i in range(count)])
+        ids = [item._id for item in items]
+        log = instrumentation.add_hook(StatementLog())
+        self.addCleanup(instrumentation.remove_hook, log)
+        query = Item.entities.query(filter_by=[("_id", "in", ids)], order_by="size")
+        self.assertEqual(list(query.values_list("name", flat=True))[:2], ["item0521", "item0520"])
+        self.assertEqual(len(log.statements), 2)
+        for sql in log.statements:
+            # Only the projected and the ordered columns are read.
+            self.assertIn('"name"', sql)
+            self.assertIn('AS "size"', sql)
+            self.assertNotIn('AS "rank"', sql)
+        partial = list(Item.entities.query(filter_by=[("_id", "in", ids)], order_by="-size").only("name"))
+        self.assertEqual(partial[0].name, "item0000")
+        self.assertRaises(ValueError, partial[0].save)
+
+
+class CountTest(SqliteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.items = Item.entities.bulk_create([Item(name="item%d" % i, size=i % 3) for i in range(10)])
+        Other.entities.bulk_create([Other(name="other%d" % i, size=i % 3) for i in range(7)])
+
+    def test_count(self):
+        self.assertEqual(Item.entities.count(), 10)
+        self.assertEqual(Item.entities.count(size=0), 4)
+        self.assertEqual(Item.entities.query(filter_by=[("size", ">", 0)]).count(), 6)
+        self.assertEqual(Item.entities.query(limit=3).count(), 3)
+        self.assertEqual(Item.entities.query(offset=8).count(), 2)
+        self.assertEqual(Item.entities.query(offset=20).count(), 0)
+        ids = [item._id for item in self.items] * 2 + list(range(100, 100 + uorm.sqlite.MAX_IN_VALUES))
+        self.assertEqual(Item.entities.query(filter_by=[("_id", "in", ids)]).count(), 10)
+
+    def test_count_after(self):
+        for kind, count in ((Item, 10), (Other, 7)):
+            query = kind.entities.query(order_by="size")
+            first = list(kind.entities.query(order_by=query.keyset_order(), limit=4))
+            after = query.sort_key(first[-1])
+            self.assertEqual(kind.entities.query(order_by="size", after=after).count(), count - 4)
+            self.assertTrue(kind.entities.query(order_by="size", after=after).exists())
+
+    def test_exists(self):
+        log = instrumentation.add_hook(StatementLog())
+        self.addCleanup(instrumentation.remove_hook, log)
+        self.assertTrue(Item.entities.exists(name="item3"))
+        self.assertFalse(Item.entities.exists(name="missing"))
+        self.assertTrue(Item.entities.query(offset=9).exists())
+        self.assertFalse(Item.entities.query(offset=10).exists())
+        self.assertTrue(all(sql.startswith('SELECT 1 AS "exists"') for sql in log.statements))
+        ids = list(range(100, 100 + uorm.sqlite.MAX_IN_VALUES)) + [self.items[0]._id]
+        self.assertTrue(Item.entities.query(filter_by=[("_id", "in", ids)]).exists())
+        self.assertFalse(Item.entities.query(filter_by=[("_id", "in", ids)], offset=1).exists())
+
+
+class KeysetTest(SqliteTestCase):
+    def test_page_two_kinds(self):
+        Item.entities.bulk_create([Item(name="item%d" % i, size=i % 3) for i in range(10)])
+        Other.entities.bulk_create([Other(name="other%d" % i, size=i % 3) for i in range(7)])
+        # Both kinds share the keyset order, e.g. ("size", "_id"), in one connection.
+        for order_by in ("size", "-size", "_id"):
+            for kind in (Item, Other):
+                query = kind.entities.query(order_by=order_by)
+                expected = [e._id for e in kind.entities.query(order_by=query.keyset_order()).all()]
+                chunks = list(query.iter_chunks(3))
+                self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+                self.assertEqual([e._id for chunk in chunks for e in chunk], expected)
+
+
+
+class DirtyTrackingTest(SqliteTestCase):
+    def test_json_changed_in_place(self):
+        document = Document.entities.create(data={"a": 1})
+        document = Document.entities.get(_id=document._id)
+        self.assertFalse(document.save())
+        document.data["a"] = 2
+        self.assertTrue(document.save())
+        self.assertFalse(document.save())
+        self.assertEqual(Document.entities.get(_id=document._id).data, {"a": 2})
+
+    def test_snapshot_value(self):
+        # hash(-1) == hash(-2) in CPython; snapshots must not depend on hash().
+        self.assertNotEqual(uorm.entity.snapshot_value(-1), uorm.entity.snapshot_value(-2))
+        self.assertNotEqual(uorm.entity.snapshot_value(b"[-1]"), uorm.entity.snapshot_value(b"[-2]"))
+        self.assertEqual(uorm.entity.snapshot_value(b"[1]"), uorm.entity.snapshot_value(b"[1]"))
+
+
+
+class UniqueIndexTest(SqliteTestCase):
+    def index_list(self):
+        with self.db.conn as conn:
+            return {row["name"]: row["unique"] for row in conn.execute('PRAGMA index_list("test_Pair")')}
+
+    def test_unique_combination(self):
+        Pair.entities.bulk_create([Pair(first="a", second="x"), Pair(first="a", second="y"),
+            Pair(first="b", second="x")])
+        with self.assertRaises(sqlite3.IntegrityError):
+            Pair.entities.create(first="a", second="x")
+        self.assertEqual(Pair.entities.count(), 3)
+        self.assertEqual(self.index_list(), {"test_Pair_first_second_unique": 1})
+
+    def test_replaces_plain_index(self):
+        with self.db.conn as conn:
+            conn.executescript('DROP INDEX "test_Pair_first_second_unique";'
+                'CREATE INDEX "test_Pair_first_second_index" ON "test_Pair" ("first", "second");')
+        self.db.close()
+        self.db = uorm.sqlite.Connection(os.path.join(self.directory, "test.sqlite"), "test")
+        set_default_db(self.db)
+        self.assertEqual(self.index_list(), {"test_Pair_first_second_unique": 1})
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = uorm.sqlite.ConnectionPool(os.path.join(self.directory, "pool.sqlite"), size=2, timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def acquire_in_thread(self, release=False):
+        result = []
+        def acquire():
+            try:
+                result.append(self.pool.acquire())
+                if release:
+                    self.pool.release()
+            except Exception as e:
+                result.append(e)
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_size_is_enforced(self):
+        conn = self.pool.acquire()
+        self.assertIs(self.pool.acquire(), conn)
+        held = threading.Event()
+        done = threading.Event()
+        def hold():
+            self.pool.acquire()
+            held.set()
+            done.wait()
+            self.pool.release()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        self.assertIsInstance(self.acquire_in_thread(), uorm.sqlite.PoolTimeout)
+        done.set()
+        thread.join()
+        self.assertIsInstance(self.acquire_in_thread(release=True), sqlite3.Connection)
+        self.pool.release()
+        self.assertEqual(len(self.pool.idle), 2)
+
+    def test_waiting_thread_gets_released_connection(self):
+        self.pool.timeout = 5
+        self.pool.acquire()
+        self.acquire_in_thread(release=True)
+        held = threading.Event()
+        blocker = threading.Event()
+        def hold():
+            self.pool.acquire()
+            held.set()
+            blocker.wait()
+            self.pool.release()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        timer = threading.Timer(0.05, blocker.set)
+        timer.start()
+        self.assertIsInstance(self.acquire_in_thread(), sqlite3.Connection)
+        thread.join()
+
+    def test_connections_of_exited_threads_are_reclaimed(self):
+        first = self.acquire_in_thread()
+        second = self.acquire_in_thread()
+        self.assertIsNot(first, second)
+        self.assertIn(self.acquire_in_thread(), (first, second))
+        self.assertIn(self.pool.acquire(), (first, second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,7 @@
+from .default import get_default_db
 
-from .fields import String, Json
+from .fields import String, Integer, Timestamp, Json
 from .entity import Entity
+from . import instrumentation
+from . import session
+from . import aio
@@ -0,0 +1,61 @@
+"""Run blocking uorm operations from asyncio code.
+
+Every backend call is handed to a thread pool owned by the database
+connection, so the event loop never waits for SQLite. The pool has as many
+workers as the connection pool has connections. Workers release their
+connection after every operation, so they never starve other threads of
+the bounded connection pool.
+
+The a-prefixed methods of EntityManager, Query and Entity (aget(), asave(),
+`async for` over a query, ...) are thin wrappers over the blocking ones and
+have the same semantics. Sessions (uorm.session) are bound to a thread and
+therefore do not apply to them.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 8
+# Results fetched per page by `async for` if neither the query nor the backend sets a batch size.
+DEFAULT_CHUNK_SIZE = 256
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def executor(db):
+    """Return the thread pool running operations of a database connection."""
+    try:
+        return _executors[db]
+    except KeyError:
+        pass
+    with _lock:
+        pool = _executors.get(db)
+        if pool is None:
+            workers = getattr(getattr(db, "pool", None), "size", DEFAULT_WORKERS)
+            pool = _executors[db] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uorm")
+    return pool
+
+
+def shutdown(db, wait=True):
+    """Stop the thread pool of a database connection, e.g. before it is closed."""
+    with _lock:
+        pool = _executors.pop(db, None)
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+async def run(db, func, *args, **kwargs):
+    """Call func(*args, **kwargs) in the thread pool of db and return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(db), functools.partial(_call, db, func, args, kwargs))
+
+
+def _call(db, func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        release = getattr(db, "release", None)
+        if release is not None:
+            release()
@@ -0,0 +1,114 @@
+"""Query plan auditing for the SQLite backend.
+
+With an audit enabled, every distinct query shape compiled by
+uorm.sqlite.Connection is run through EXPLAIN QUERY PLAN once. Shapes that
+scan a whole table although they filter or limit rows, or that sort rows in
+a temporary B-tree, are flagged:
+
+    audit = PlanAudit()
+    uorm.get_default_db().enable_plan_audit(audit)
+    ...  # exercise the application
+    audit.check(baseline=KNOWN_SQL)  # raises UnindexedQueryError for new problems
+
+Auditing is meant for debugging and tests; it costs nothing when disabled.
+"""
+import logging
+import re
+import threading
+
+FULL_SCAN = "full scan"
+TEMP_SORT = "temp b-tree"
+
+# "SCAN t" in recent SQLite, "SCAN TABLE t" in older; index scans mention USING.
+_FULL_SCAN_RE = re.compile(r'^SCAN (TABLE )?"?[^" ]+"?( AS \S+)?$')
+_TEMP_SORT_RE = re.compile(r"^USE TEMP B-TREE")
+
+
+class UnindexedQueryError(Exception):
+    def __init__(self, plans):
+        self.plans = plans
+        super().__init__("Queries without a suitable index:\n" + "\n".join(
+            "  %s (%s): %s" % (plan.sql, ", ".join(plan.problems), "; ".join(plan.details)) for plan in plans))
+
+
+class QueryPlan:
+    __slots__ = ("kind", "operation", "sql", "details", "problems", "uses")
+
+    def __init__(self, kind, operation, sql, details, problems):
+        self.kind = kind
+        self.operation = operation
+        self.sql = sql
+        self.details = details
+        self.problems = problems
+        self.uses = 1
+
+    def as_dict(self):
+        return {
+            "kind": self.kind.__name__ if isinstance(self.kind, type) else self.kind,
+            "operation": self.operation,
+            "sql": self.sql,
+            "plan": list(self.details),
+            "problems": list(self.problems),
+            "uses": self.uses,
+        }
+
+
+def analyze(details, selective=True):
+    """Return problems found in EXPLAIN QUERY PLAN details.
+
+    A full scan is only a problem for selective queries, i.e. those with filters or a limit;
+    reading a whole table is inherent to the others."""
+    problems = []
+    for detail in details:
+        if selective and _FULL_SCAN_RE.match(detail) and FULL_SCAN not in problems:
+            problems.append(FULL_SCAN)
+        elif _TEMP_SORT_RE.match(detail) and TEMP_SORT not in problems:
+            problems.append(TEMP_SORT)
+    return problems
+
+
+class PlanAudit:
+    """Query plans aggregated per query shape."""
+    def __init__(self, logger=None, level=logging.WARNING):
+        self.logger = logger or logging.getLogger("uorm")
+        self.level = level
+        self.lock = threading.Lock()
+        self.plans = {}
+
+    def record(self, shape, kind, operation, sql, details, selective=True):
+        problems = analyze(details, selective)
+        with self.lock:
+            plan = self.plans.get(shape)
+            if plan is not None:
+                plan.uses += 1
+                return plan
+            plan = self.plans[shape] = QueryPlan(kind, operation, sql, tuple(details), tuple(problems))
+        if problems:
+            self.logger.log(self.level, "Query plan of %s %s: %s: %s", plan.as_dict()["kind"], operation,
+                ", ".join(problems), sql)
+        return plan
+
+    def used(self, shape):
+        plan = self.plans.get(shape)
+        if plan is not None:
+            plan.uses += 1
+
+    def problems(self, baseline=()):
+        """Return flagged plans whose SQL is not in baseline."""
+        baseline = set(baseline)
+        with self.lock:
+            return [plan for plan in self.plans.values() if plan.problems and plan.sql not in baseline]
+
+    def check(self, baseline=()):
+        """Raise UnindexedQueryError if there are flagged plans not in baseline."""
+        problems = self.problems(baseline)
+        if problems:
+            raise UnindexedQueryError(problems)
+
+    def report(self):
+        with self.lock:
+            return [plan.as_dict() for plan in self.plans.values()]
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
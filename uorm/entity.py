@@ -1,81 +1,163 @@
 _ID= "_id"
 KINDS = []
 _EXTRA_DATA = "_extra_data"
+ENTITIES = "entities"
+DICTS = "dicts"
+TUPLES = "tuples"
+FLAT = "flat"
+
+import hashlib
 
 from .default import get_default_db
-from .fields import Field
+from .fields import Field, Lazy
+from .session import current as current_session
+from . import aio
+
+SLOT_PREFIX = "_v_"
+
+def snapshot_value(raw):
+    """Return what is remembered of a serialized value to detect in-place changes.
+    
+    Immutable scalars are kept as they are. Payloads such as serialized Json are reduced to a digest,
+    which, unlike hash(), does not collide for different values in practice."""
+    if raw is None or isinstance(raw, (str, int, float)):
+        return raw
+    return hashlib.blake2b(raw, digest_size=20).digest()
 
 class EntityBase:
+    __slots__ = ("_new", "_dirty", "_snapshots", "_partial", _EXTRA_DATA)
+    
     def __init__(self, **data):
-        self.__dict__[_EXTRA_DATA] = {}
+        self._extra_data = {}
         self._new = True
-        self._modified = True
+        self._dirty = set()
+        self._snapshots = None
+        self._partial = False
         klass = self.__class__
         for name, value in data.items():
-            self.__dict__[name] = value
+            field = getattr(klass, name, None)
+            if not isinstance(field, Field):
+                raise TypeError("Kind '%s' has no field '%s'." % (klass.__name__, name))
+            field.slot.__set__(self, value)
     
     @classmethod
     def _from_data(klass, data):
-        entity = klass()
-        entity._load(data)
-        return entity
-        
-    def _load(self, data):
-        klass = self.__class__
+        """Build an entity from a database row without validation."""
+        entity = klass.__new__(klass)
+        entity._new = False
+        entity._dirty = set()
+        entity._snapshots = None
+        entity._partial = False
+        extra_data = entity._extra_data = {}
+        loaders = klass._loaders
         for name, value in data.items():
-            field = getattr(klass, name)
-            self.__dict__[name] = field.deserialize(value)
-            
+            try:
+                slot, field = loaders[name]
+            except KeyError:
+                extra_data[name] = value
+                continue
+            if value is None or field is None:
+                slot.__set__(entity, value)
+            elif field.lazy:
+                # Decoded on first access by Field.__get__; written back as is if never accessed.
+                slot.__set__(entity, Lazy(value))
+            else:
+                slot.__set__(entity, field.deserialize(value))
+                if field.mutable:
+                    entity._snapshot(name, value)
+        return entity
+    
+    def _snapshot(self, name, raw):
+        """Remember the serialized value of a mutable field to detect in-place changes."""
+        snapshots = self._snapshots
+        if snapshots is None:
+            snapshots = self._snapshots = {}
+        snapshots[name] = snapshot_value(raw)
+    
+    def _detect_changes(self):
+        """Add mutable fields changed in place to dirty fields; returns whether anything changed."""
+        dirty = self._dirty
+        snapshots = self._snapshots
+        for name, field in self.__class__._fields:
+            if not field.mutable or name in dirty:
+                continue
+            try:
+                value = field.slot.__get__(self)
+            except AttributeError:
+                continue
+            if value is None or isinstance(value, Lazy):
+                continue
+            if snapshots is None or snapshot_value(field.serialize(value)) != snapshots.get(name):
+                dirty.add(name)
+        return bool(dirty)
+    
+    def _dirty_data(self):
+        """Serialized values of dirty fields."""
+        data = {}
+        for name, field in self.__class__._fields:
+            if name in self._dirty:
+                value = field.slot.__get__(self)
+                data[name] = field.serialize(value) if value is not None else None
+        return data
+    
+    def _mark_saved(self, data):
+        """Reset change tracking after data (serialized values) have been written."""
         self._new = False
-        self._modified = False
+        self._dirty.clear()
+        for name, field in self.__class__._fields:
+            if field.mutable and name in data and data[name] is not None:
+                self._snapshot(name, data[name])
     
-    def __getattribute__(self, name):
-        val =  object.__getattribute__(self, name)
-        if isinstance(val, Field):
-            return None
-        return val
-        
-    def __setattr__(self, name, value):
-        if name[0] == "_":
-            object.__setattr__(self, name, value)
-            return
-        klass = self.__class__
-        field = getattr(klass, name)
-        field.validate(value)
-        try:
-            if self.__dict__[name] != value:
-                self.__dict__[name] = value
-                self._set_modified(True)
-        except KeyError:
-            self.__dict__[name] = value
-            self._set_modified(True)
+    def _raw_values(self):
+        """Yield (name, field, value) of fields that are set, including undecoded Lazy values."""
+        for name, field in self.__class__._fields:
+            try:
+                yield name, field, field.slot.__get__(self)
+            except AttributeError:
+                pass
     
     def _as_data(self):
-        values = self.__dict__
-        data = values[_EXTRA_DATA].copy()
-        klass = self.__class__
-        for name, field in klass._fields:
+        data = self._extra_data.copy()
+        for name, field in self.__class__._fields:
             try:
-                value = values[name]
-                data[name] = field.serialize(value) if value is not None else None
-            except KeyError:
+                value = field.slot.__get__(self)
+            except AttributeError:
                 data[name] = field.default
+                continue
+            if isinstance(value, Lazy):
+                data[name] = value.raw
+            else:
+                data[name] = field.serialize(value) if value is not None else None
         return data
     
+    def _pre_save(self):
+        for name, field in self.__class__._fields:
+            try:
+                value = field.slot.__get__(self)
+            except AttributeError:
+                value = None
+            new_value = field.pre_save(value)
+            if new_value is not value:
+                field.__set__(self, new_value)
+    
     def _set_new(self, value):
         self._new = value
         
     def _set_modified(self, value):
-        self._modified = value
+        if value:
+            self._dirty.update(name for name, field in self.__class__._fields)
+        else:
+            self._dirty.clear()
     
     def _is_new(self):
         return self._new
         
     def _is_modified(self):
-        return self._modified
+        return self._detect_changes()
     
     def __repr__(self):
-        return "<%s: %s>" % (self.__class__.__name__, repr(self.__dict__))
+        values = dict((name, value) for name, field, value in self._raw_values())
+        return "<%s: %s>" % (self.__class__.__name__, repr(values))
 
 class EntityMetaBase(type):
     def __new__(meta, class_name, bases, dct):
@@ -87,8 +169,18 @@ class EntityMetaBase(type):
                     field.name = name
                     fields.append(item)
             dct["_fields"] = fields
+            dct["__slots__"] = tuple(SLOT_PREFIX + name for name, field in fields)
             
-        return super(EntityMetaBase, meta).__new__(meta, class_name, bases, dct)
+        klass = super(EntityMetaBase, meta).__new__(meta, class_name, bases, dct)
+        if bases != (EntityBase,):
+            loaders = {}
+            for name, field in klass._fields:
+                field.slot = klass.__dict__[SLOT_PREFIX + name]
+                loaders[name] = (field.slot, field)
+            klass._loaders = loaders
+            klass._unique_fields = (_ID,) + tuple(
+                name for name, field in klass._fields if field.unique and name != _ID)
+        return klass
 
 class EntityManager:
     def __init__(self, kind):
@@ -103,9 +195,57 @@ class EntityManager:
         return entity
     
     def save(self, entity, db=None):
+        """Save the entity if it is new or has changed; returns whether it has been (or will be) written.
+        
+        Within a session, the entity is queued and written when the session is flushed."""
+        if entity._partial:
+            raise ValueError("Entity loaded with Query.only() cannot be saved.")
+        session = current_session(db)
+        if session is not None:
+            if not entity._new and not entity._detect_changes():
+                return False
+            session.save(entity)
+            return True
         if not db:
             db = get_default_db()
-        db.save(entity)
+        if not entity._new and not entity._detect_changes():
+            return False
+        entity._pre_save()
+        return db.save(entity)
+    
+    def bulk_create(self, entities, db=None):
+        """Create many entities at once; auto-assigned ids are set on them."""
+        entities = [entity if isinstance(entity, self.kind) else self.kind(**entity) for entity in entities]
+        self.bulk_save(entities, db)
+        return entities
+    
+    def bulk_save(self, entities, db=None):
+        """Save many entities in a single backend round trip where possible.
+        
+        Entities that are neither new nor changed are skipped; returns the number written."""
+        entities = list(entities)
+        for entity in entities:
+            if entity._partial:
+                raise ValueError("Entity loaded with Query.only() cannot be saved.")
+        session = current_session(db)
+        if session is not None:
+            count = 0
+            for entity in entities:
+                if entity._new or entity._detect_changes():
+                    session.save(entity)
+                    count += 1
+            return count
+        return self._write(entities, db or get_default_db())
+    
+    def _write(self, entities, db):
+        changed = []
+        for entity in entities:
+            if entity._new or entity._detect_changes():
+                entity._pre_save()
+                changed.append(entity)
+        if changed:
+            db.bulk_save(changed)
+        return len(changed)
     
     def query(self, _db=None, **kwargs):
         if not _db:
@@ -113,24 +253,88 @@ class EntityManager:
         return Query(_db, self.kind, **kwargs)
     
     def get(self, _db=None, **equality_filters):
+        session = current_session(_db)
+        if session is not None:
+            found, entity = session.lookup(self.kind, equality_filters)
+            if found:
+                if entity is None:
+                    raise self.kind.DoesNotExist()
+                return entity
         filter_by = [(key, "=", value) for key, value in equality_filters.items()]
-        return self.query(filter_by=filter_by).one()
+        try:
+            return self.query(_db=_db, filter_by=filter_by).one()
+        except self.kind.DoesNotExist:
+            if session is not None:
+                session.add_missing(self.kind, equality_filters)
+            raise
     
     def exists(self, _db=None, **equality_filters):
+        session = current_session(_db)
+        if session is not None and any(name in self.kind._unique_fields for name in equality_filters):
+            # Load the whole entity so that later lookups are answered by the identity map.
+            try:
+                self.get(_db=_db, **equality_filters)
+                return True
+            except self.kind.DoesNotExist:
+                return False
         filter_by = [(key, "=", value) for key, value in equality_filters.items()]
-        return self.query(filter_by=filter_by).exists()
+        return self.query(_db=_db, filter_by=filter_by).exists()
+    
+    def count(self, _db=None, **equality_filters):
+        filter_by = [(key, "=", value) for key, value in equality_filters.items()]
+        return self.query(_db=_db, filter_by=filter_by).count()
         
     def all(self, _db=None):
         return self.query(_db=_db).all()
         
-    def delete_by(self, _db=None, **kwargs):
+    def delete_by(self, _db=None, filter_by=None, **kwargs):
         if not _db:
             _db = get_default_db()
-        return _db.delete_by(self.kind, **kwargs)
+        session = current_session(_db)
+        if session is not None:
+            session.flush()
+        count = _db.delete_by(self.kind, filter_by=filter_by, **kwargs)
+        if session is not None:
+            session.forget(self.kind)
+        return count
+    
+    # Asynchronous variants running in the thread pool of the database, see uorm.aio.
+    
+    async def acreate(self, *, db=None, **data):
+        return await aio.run(db or get_default_db(), lambda: self.create(db=db, **data))
+    
+    async def asave(self, entity, db=None):
+        return await aio.run(db or get_default_db(), self.save, entity, db)
+    
+    async def abulk_create(self, entities, db=None):
+        return await aio.run(db or get_default_db(), self.bulk_create, entities, db)
+    
+    async def abulk_save(self, entities, db=None):
+        return await aio.run(db or get_default_db(), self.bulk_save, entities, db)
+    
+    async def aget(self, _db=None, **equality_filters):
+        return await aio.run(_db or get_default_db(), self.get, _db, **equality_filters)
+    
+    async def aexists(self, _db=None, **equality_filters):
+        return await aio.run(_db or get_default_db(), self.exists, _db, **equality_filters)
+    
+    async def acount(self, _db=None, **equality_filters):
+        return await aio.run(_db or get_default_db(), self.count, _db, **equality_filters)
+    
+    async def aall(self, _db=None):
+        return await self.query(_db=_db).aall()
+    
+    async def adelete_by(self, _db=None, filter_by=None, **kwargs):
+        return await aio.run(_db or get_default_db(), self.delete_by, _db, filter_by, **kwargs)
         
 
 class Query:
-    def __init__(self, db, kind, offset=0, limit=None, order_by=None, filter_by=None):
+    def __init__(self, db, kind, offset=0, limit=None, order_by=None, filter_by=None, after=None, batch_size=None):
+        """Query entities of a kind.
+        
+        `after` is the sort key of the last result of the previous page, see sort_key(). It restricts
+        results to those following it in the keyset order: order_by with _id appended as a tie-breaker.
+        `batch_size` is the number of rows a backend fetches at once while results are iterated."""
         self.db = db;
         self.kind = kind
         self.offset = offset
@@ -139,26 +343,183 @@ class Query:
             order_by = [order_by]
         self.order_by = order_by
         self.filter_by = filter_by
+        self.after = tuple(after) if after is not None else None
+        self.batch_size = batch_size
+        self.fields = None
+        self.result_type = ENTITIES
+        self.session = current_session(db)
     
-    def all(self):
-        self.limit = None
-        self.offset = 0
+    def only(self, *fields):
+        """Load only the given fields; resulting entities cannot be saved."""
+        self.fields = self._check_fields(fields)
+        self.result_type = ENTITIES
+        return self
+    
+    def values(self, *fields):
+        """Return dicts of deserialized values instead of entities."""
+        self.fields = self._check_fields(fields) if fields else self._all_fields()
+        self.result_type = DICTS
+        return self
+    
+    def values_list(self, *fields, flat=False):
+        """Return tuples of deserialized values, or bare values of a single field if flat."""
+        if flat and len(fields) != 1:
+            raise ValueError("values_list(flat=True) requires exactly one field.")
+        self.fields = self._check_fields(fields) if fields else self._all_fields()
+        self.result_type = FLAT if flat else TUPLES
+        return self
+    
+    def _all_fields(self):
+        return (_ID,) + tuple(name for name, field in self.kind._fields)
+    
+    def _check_fields(self, fields):
+        names = self._all_fields()
+        for name in fields:
+            if name not in names:
+                raise ValueError("Kind '%s' has no field '%s'." % (self.kind.__name__, name))
+        return tuple(fields)
+    
+    def _convert(self, data):
+        """Convert a backend row, a dict of raw column values, to the requested result type."""
+        if self.result_type == ENTITIES:
+            entity = self.kind._from_data(data)
+            if self.fields is not None:
+                entity._partial = True
+            elif self.session is not None:
+                entity = self.session.add(entity)
+            return entity
+        values = []
+        klass = self.kind
+        for name in self.fields:
+            value = data.get(name)
+            if name != _ID and value is not None:
+                value = getattr(klass, name).deserialize(value)
+            values.append(value)
+        if self.result_type == DICTS:
+            return dict(zip(self.fields, values))
+        if self.result_type == FLAT:
+            return values[0]
+        return tuple(values)
+    
+    def keyset_order(self):
+        """Return order_by with _id appended unless it is already ordered by _id."""
+        order_by = list(self.order_by or ())
+        if not any(order.lstrip("-") == _ID for order in order_by):
+            order_by.append(_ID)
+        return order_by
+    
+    def sort_key(self, item):
+        """Return the keyset position of a result item, to be passed as `after` to get the next page.
+        
+        The item must contain all fields of keyset_order(); values are in their stored form."""
+        names = [order.lstrip("-") for order in self.keyset_order()]
+        if self.result_type == ENTITIES:
+            values = [getattr(item, name) for name in names]
+        elif self.result_type == DICTS:
+            values = [item[name] for name in names]
+        else:
+            if self.result_type == FLAT:
+                item = (item,)
+            try:
+                values = [item[self.fields.index(name)] for name in names]
+            except ValueError:
+                raise ValueError("Sort key fields %s must be selected." % (names,))
+        klass = self.kind
+        key = []
+        for name, value in zip(names, values):
+            field = getattr(klass, name, None)
+            if isinstance(field, Field) and value is not None:
+                value = field.serialize(value)
+            key.append(value)
+        return tuple(key)
+    
+    def iter_chunks(self, size):
+        """Yield lists of at most size results, paging by keyset so that every page costs the same.
+        
+        The query's offset applies to the first page and its limit to the total number of results."""
+        remaining = self.limit
+        offset = self.offset
+        # Every page, including the first one, must follow the order the keyset is based on.
+        self.order_by = self.keyset_order()
+        if self.batch_size is None:
+            self.batch_size = size
+        while remaining is None or remaining > 0:
+            self.limit = size if remaining is None else min(size, remaining)
+            self.offset = offset
+            chunk = list(self._execute())
+            if chunk:
+                yield chunk
+            if len(chunk) < self.limit:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            offset = 0
+            self.after = self.sort_key(chunk[-1])
+    
+    def _execute(self):
+        if self.session is not None:
+            # Let the query see saves queued in the session.
+            self.session.flush()
         return self.db.exec_query(self)
     
+    def __iter__(self):
+        return iter(self._execute())
+    
+    def all(self):
+        return self._execute()
+    
     def one(self):
         self.limit = 1
-        result = tuple(self.db.exec_query(self))
+        result = tuple(self._execute())
         if result:
             return result[0]
         else:
             raise self.kind.DoesNotExist()
     
+    def count(self):
+        """Return the number of matching entities without loading them."""
+        if self.session is not None:
+            self.session.flush()
+        return self.db.count(self)
+    
     def exists(self):
-        try:
-            self.one()
-            return True
-        except self.kind.DoesNotExist:
-            return False
+        """Return whether any entity matches without loading it."""
+        if self.session is not None:
+            self.session.flush()
+        return self.db.exists(self)
+    
+    # Asynchronous variants running in the thread pool of the database, see uorm.aio.
+    
+    async def aall(self):
+        """Return a list of all results."""
+        return await aio.run(self.db, lambda: list(self.all()))
+    
+    async def aone(self):
+        return await aio.run(self.db, self.one)
+    
+    async def acount(self):
+        return await aio.run(self.db, self.count)
+    
+    async def aexists(self):
+        return await aio.run(self.db, self.exists)
+    
+    async def __aiter__(self):
+        """Iterate over results fetched page by page, see iter_chunks().
+        
+        Results without the fields of the keyset order cannot be paged and are fetched at once."""
+        names = [order.lstrip("-") for order in self.keyset_order()]
+        if self.result_type == ENTITIES and self.fields is None or all(name in self.fields for name in names):
+            size = self.batch_size or getattr(self.db, "batch_size", None) or aio.DEFAULT_CHUNK_SIZE
+            chunks = self.iter_chunks(size)
+            while True:
+                chunk = await aio.run(self.db, next, chunks, None)
+                if chunk is None:
+                    break
+                for item in chunk:
+                    yield item
+        else:
+            for item in await self.aall():
+                yield item
 
 class DoesNotExistError(Exception):
     def __init__(self, kind):
@@ -168,6 +529,10 @@ class EntityMeta(EntityMetaBase):
     def __init__(cls, name, bases, dct):
         if bases != (EntityBase,):
             KINDS.append(cls)
+            field = dct.get(_ID)
+            cls._id_field = field if isinstance(field, Field) else None
+            if not cls._id_field:
+                cls._loaders[_ID] = (_ID_SLOT, None)
         cls.entities = EntityManager(cls)
         class DoesNotExist(DoesNotExistError):
             def __init__(self):
@@ -176,40 +541,31 @@ class EntityMeta(EntityMetaBase):
         super(EntityMeta, cls).__init__(name, bases, dct)
 
 class Entity(EntityBase, metaclass=EntityMeta):
+    __slots__ = (_ID,)
     
     def __init__(self, _id=None, **data):
-        try:
-            field = getattr(self.__class__, _ID)
+        field = self.__class__._id_field
+        if field:
             if _id is not None:
                 field.validate(_id)
-            self.__dict__[_ID] = _id
-        except AttributeError:
-            self.__dict__[_ID] = _id
+            field.slot.__set__(self, _id)
+        else:
+            _ID_SLOT.__set__(self, _id)
         
         super().__init__(**data)
     
+    @classmethod
+    def _from_data(klass, data):
+        entity = super()._from_data(data)
+        if _ID not in data and not klass._id_field:
+            _ID_SLOT.__set__(entity, None)
+        return entity
+    
     def save(self, db=None):
-        self.entities.save(self, db=db)
+        return self.entities.save(self, db=db)
     
-    def _load(self, data):
-        try:
-            _id = data[_ID]
-            del(data[_ID])
-            try:
-                self.__setattr__(_ID, _id)
-            except AttributeError:
-                self.__dict__[_ID] = _id
-        except KeyError:
-            pass
-        super()._load(data)
-    
-    def __setattr__(self, name, value):
-        if name == _ID and not hasattr(self.__class__, name):
-            if self.__dict__[name] != value:
-                self.__dict__[name] = value
-                self._set_modified(True)
-        else:
-            super().__setattr__(name, value)
+    async def asave(self, db=None):
+        return await self.entities.asave(self, db=db)
         
     def _as_data(self):
         data = super()._as_data()
@@ -217,12 +573,17 @@ class Entity(EntityBase, metaclass=EntityMeta):
             _id = data[_ID]
             del(data[_ID])
         except KeyError:
-            _id = self.__dict__.get(_ID, None)
+            _id = self._id
         if _id is None:
-            if _ID in self.__class__.__dict__:
+            if self.__class__._id_field:
                 raise ValueError("Custom _id field not set.")
         else:
             data[_ID] = _id
         return data
+    
+    def _raw_values(self):
+        if not self.__class__._id_field:
+            yield _ID, None, getattr(self, _ID, None)
+        yield from super()._raw_values()
 
-
+_ID_SLOT = Entity.__dict__[_ID]
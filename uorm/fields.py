@@ -1,4 +1,5 @@
 import json
+import time
 
 class ValidationError(Exception):
     @classmethod
@@ -11,18 +12,76 @@ class ValidationError(Exception):
         return ValidationError("The '%s' field must be of type %s but '%s' received." % (name, expected, received))
 
 
+class Lazy(object):
+    """Raw database value of a lazy field that has not been deserialized yet."""
+    __slots__ = ("raw",)
+    
+    def __init__(self, raw):
+        self.raw = raw
+    
+    def __repr__(self):
+        return "<Lazy: %d bytes>" % len(self.raw)
+
+
 class Field(object):
+    # Values that can change in place, so changes are detected by comparing snapshots.
+    mutable = False
+    
     def __init__(self, default=None, index=False, unique=False, asc=True, required=True, empty=False,
-    primary=False, autoincrement=False):
+    primary=False, autoincrement=False, lazy=False, include=(), unique_index=False):
+        """index is True for an index on the field alone, or a tuple of further fields of a composite
+        index starting with this field. include lists fields appended to the index only to cover queries
+        reading them. Field names may be prefixed with "-" for descending order. unique_index makes
+        the combination of the index columns unique, while unique applies to the field alone."""
         self.default = default
         self.index = index
+        self.include = tuple(include)
         self.unique = unique
+        self.unique_index = unique_index
         self.asc = asc
         self.required = required
         self.empty = empty
         self.primary = primary
         self.autoincrement = autoincrement
+        self.lazy = lazy
         self.name = None
+        self.slot = None
+    
+    def index_columns(self):
+        """Return the columns of the index declared by the field."""
+        columns = [self.name]
+        if isinstance(self.index, (tuple, list)):
+            columns.extend(self.index)
+        columns.extend(self.include)
+        return tuple(columns)
+    
+    # Fields are data descriptors storing values in slots of the entity, see EntityMetaBase.
+    
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            value = self.slot.__get__(instance, owner)
+        except AttributeError:
+            return None
+        if value.__class__ is Lazy:
+            raw = value.raw
+            value = self.deserialize(raw)
+            self.slot.__set__(instance, value)
+            if self.mutable:
+                instance._snapshot(self.name, raw)
+        return value
+    
+    def __set__(self, instance, value):
+        self.validate(value)
+        slot = self.slot
+        try:
+            if slot.__get__(instance) == value:
+                return
+        except AttributeError:
+            pass
+        slot.__set__(instance, value)
+        instance._dirty.add(self.name)
     
     def validate(self, value):
         """Validate Python value before it is set."""
@@ -38,6 +97,10 @@ class Field(object):
     def serialize(self, value):
         """Serialize Python value to database value."""
         return value
+    
+    def pre_save(self, value):
+        """Return the value to store when an entity is about to be saved."""
+        return value
 
 
 class String(Field):
@@ -52,6 +115,23 @@ class String(Field):
         assert isinstance(value, str)
         return value
 
+class Integer(Field):
+    def validate(self, value):
+        self.validate_types(value, int)
+
+class Timestamp(Integer):
+    """Microseconds since the epoch, optionally refreshed on every save."""
+    def __init__(self, auto_now=False, **kwargs):
+        super().__init__(**kwargs)
+        self.auto_now = auto_now
+    
+    @staticmethod
+    def now():
+        return int(time.time() * 1000000)
+    
+    def pre_save(self, value):
+        return self.now() if self.auto_now else value
+
 class Blob(Field):
     def __init__(self, **kwargs):
         super().__init__(index=False, primary=False, unique=False, **kwargs)
@@ -60,6 +140,11 @@ class Blob(Field):
         self.validate_types(value, bytes)
 
 class Json(Blob):
+    mutable = True
+    
+    def __init__(self, lazy=True, **kwargs):
+        super().__init__(lazy=lazy, **kwargs)
+    
     def validate(self, value):
         self.validate_types(value, list, tuple, dict)
 
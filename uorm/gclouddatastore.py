@@ -1,5 +1,39 @@
 from .default import set_default_db
+from . import instrumentation
 from gcloud import datastore
+from itertools import dropwhile, islice
+
+# Maximum number of entities in a single Datastore commit.
+PUT_BATCH_SIZE = 500
+
+def expand_in_filters(filter_by):
+    """Datastore has no IN operator; return equality filter lists covering every combination."""
+    expanded = [[]]
+    for name, operator, value in filter_by or ():
+        if operator.lower() == "in":
+            # Without duplicates, the queries match disjoint sets of entities.
+            expanded = [f + [(name, "=", v)] for f in expanded for v in dict.fromkeys(value)]
+        else:
+            expanded = [f + [(name, operator, value)] for f in expanded]
+    return expanded
+
+
+def datastore_order(order_by):
+    """Map the _id pseudo-field of uorm orderings to Datastore's __key__."""
+    return ["-__key__" if order == "-_id" else "__key__" if order == "_id" else order for order in order_by]
+
+
+def row_key(entry, order_by):
+    return [entry.key.id if order.lstrip("-") == "_id" else entry.get(order.lstrip("-")) for order in order_by]
+
+
+def follows(values, after, order_by):
+    """Whether a row with the given sort key values comes after a keyset position."""
+    for value, position, order in zip(values, after, order_by):
+        if value != position:
+            return value < position if order[0] == "-" else value > position
+    return False
+
 
 def connect(data_store, namespace=None):
     set_default_db(Connection(data_store, namespace))
@@ -11,6 +45,26 @@ class Connection:
         self.namespace = namespace
         self.client = datastore.Client(project=project, namespace=namespace)
     
+    def release(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def call(self, kind, operation, statement, rows, func, *args, **kwargs):
+        """Call a client method, reporting it to instrumentation hooks."""
+        if not instrumentation.hooks:
+            return func(*args, **kwargs)
+        
+        event = instrumentation.start(kind, operation, statement)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            instrumentation.finish(event, error=e)
+            raise
+        instrumentation.finish(event, rows)
+        return result
+    
     def create_key(self, entity_class, entity_id=None):
         entity_kind = entity_class.__name__
         if entity_id:
@@ -18,61 +72,167 @@ class Connection:
         return self.client.key(entity_kind)
     
     def save(self, entity):
+        """Put the whole entity; Datastore has no partial updates, so changed entities are written in full."""
         data = entity._as_data()
-        print("Save entity: %s" % data)
         key = self.create_key(entity.__class__, data.get("_id"))
         ds_entity = datastore.Entity(key=key, exclude_from_indexes=[])
         ds_entity.update(data)
-        self.client.put(ds_entity)
+        self.call(entity.__class__, "put", None, 1, self.client.put, ds_entity)
         entity._id = key.id
+        entity._mark_saved(data)
+        return True
+    
+    def bulk_save(self, entities):
+        ds_entities = []
+        for entity in entities:
+            data = entity._as_data()
+            key = self.create_key(entity.__class__, data.get("_id"))
+            ds_entity = datastore.Entity(key=key, exclude_from_indexes=[])
+            ds_entity.update(data)
+            ds_entities.append(ds_entity)
+        for i in range(0, len(ds_entities), PUT_BATCH_SIZE):
+            batch = ds_entities[i:i + PUT_BATCH_SIZE]
+            kind = entities[i].__class__
+            self.call(kind, "put", None, len(batch), self.client.put_multi, batch)
+        for entity, ds_entity in zip(entities, ds_entities):
+            entity._id = ds_entity.key.id
+            entity._mark_saved(ds_entity)
     
     def query(self, entity_class, offset=None, limit=None, order_by=None):
         pass
     
     def get_keys_for(self, kind, **query):
+        keys = []
+        for filter_by in expand_in_filters(query.get("filter_by")):
+            kwargs = {
+                "kind": kind.__name__,
+                
+            }
+            order_by = query.get("order_by")
+            if order_by:
+                kwargs["order"] = order_by
+            if filter_by:
+                kwargs["filters"] = filter_by
+            
+            q = self.client.query(**kwargs)
+            q.keys_only()
+            keys.extend(entry.key for entry in self.call(kind, "select_keys", kwargs, None, q.fetch))
+        return iter(keys)
+    
+    def create_query(self, query, filter_by, keys_only=False):
+        """Build a Datastore query.
+        
+        Datastore allows an inequality filter on a single property only, so a keyset position becomes
+        an inclusive filter on the first ordered property; rows not following the position are skipped
+        by exec_query()."""
         kwargs = {
-            "kind": kind.__name__,
+            "kind": query.kind.__name__,
             
         }
-        order_by = query.get("order_by")
+        order_by = query.keyset_order() if query.after is not None else query.order_by
         if order_by:
-            kwargs["order"] = order_by
-        filter_by = query.get("filter_by")
+            kwargs["order"] = datastore_order(order_by)
+        if query.after is not None:
+            first = order_by[0]
+            descending = first[0] == "-"
+            if first.lstrip("-") == "_id":
+                keyset_filter = ("__key__", "<" if descending else ">", self.create_key(query.kind, query.after[0]))
+            else:
+                keyset_filter = (first.lstrip("-"), "<=" if descending else ">=", query.after[0])
+            filter_by = list(filter_by or ()) + [keyset_filter]
         if filter_by:
             kwargs["filters"] = filter_by
-        
+        if keys_only:
+            # Keyset positions are checked against the ordered properties, see exec_query().
+            fields = [order.lstrip("-") for order in order_by] if query.after is not None else ["_id"]
+        else:
+            fields = query.fields
+        projection = [name for name in fields or () if name != "_id"]
+        if projection:
+            # Projection queries return only indexed properties without loading whole entities.
+            kwargs["projection"] = projection
         q = self.client.query(**kwargs)
-        q.keys_only()
-        return (entry.key for entry in q.fetch())
+        if fields and not projection:
+            q.keys_only()
+        return q, kwargs
     
     def exec_query(self, query):
-        kwargs = {
-            "kind": query.kind.__name__,
-            
-        }
-        if query.order_by:
-            kwargs["order"] = query.order_by
-        if query.filter_by:
-            kwargs["filters"] = query.filter_by
-        q = self.client.query(**kwargs)
-        return Result(query.kind, q.fetch(offset=query.offset, limit=query.limit))
+        after = query.after
+        order_by = query.keyset_order() if after is not None else query.order_by
+        expanded = expand_in_filters(query.filter_by)
+        if len(expanded) == 1:
+            q, kwargs = self.create_query(query, expanded[0])
+            if after is None:
+                return Result(query, self.call(query.kind, "select", kwargs, None, q.fetch,
+                    offset=query.offset, limit=query.limit))
+            # The fetch iterator pages lazily, so skipped rows do not need to be known in advance.
+            entries = dropwhile(lambda entry: not follows(row_key(entry, order_by), after, order_by),
+                self.call(query.kind, "select", kwargs, None, q.fetch))
+            offset = query.offset or 0
+            stop = offset + query.limit if query.limit is not None else None
+            return Result(query, islice(entries, offset, stop))
+        
+        # One query per IN value; ordering and paging are applied to the union.
+        rows = []
+        for filter_by in expanded:
+            q, kwargs = self.create_query(query, filter_by)
+            for entry in self.call(query.kind, "select", kwargs, None, q.fetch):
+                if after is not None and not follows(row_key(entry, order_by), after, order_by):
+                    continue
+                entry["_id"] = entry.key.id
+                rows.append(entry)
+        for order in reversed(order_by or ()):
+            # Missing and null properties sort first, as in Datastore's ascending order.
+            name = order.lstrip("-")
+            rows.sort(key=lambda row: (row.get(name) is not None, row.get(name)), reverse=order[0] == "-")
+        offset = query.offset or 0
+        stop = offset + query.limit if query.limit is not None else None
+        return (query._convert(row) for row in rows[offset:stop])
+    
+    def matching_keys(self, query, operation, limit=None):
+        """Yield keys of matching entities from keys-only queries, which do not load entities.
+        
+        Datastore has no aggregation queries in this client, so counting iterates over keys."""
+        after = query.after
+        order_by = query.keyset_order() if after is not None else None
+        for filter_by in expand_in_filters(query.filter_by):
+            q, kwargs = self.create_query(query, filter_by, keys_only=True)
+            entries = self.call(query.kind, operation, kwargs, None, q.fetch,
+                limit=limit if after is None else None)
+            for entry in entries:
+                if after is None or follows(row_key(entry, order_by), after, order_by):
+                    yield entry.key
+    
+    def count(self, query):
+        total = sum(1 for key in self.matching_keys(query, "count"))
+        total = max(0, total - (query.offset or 0))
+        return min(total, query.limit) if query.limit is not None else total
+    
+    def exists(self, query):
+        if query.offset:
+            return self.count(query) > 0
+        for key in self.matching_keys(query, "exists", limit=1):
+            return True
+        return False
     
-    def delete_by_key(self, keys):
-        return self.client.delete_multi(keys)
+    def delete_by_key(self, keys, kind=None):
+        return self.call(kind, "delete", None, len(keys), self.client.delete_multi, keys)
         
     def delete(self, kind, entity_id):
-        return self.client.delete(self.create_key(kind, entity_id))
+        return self.call(kind, "delete", None, 1, self.client.delete, self.create_key(kind, entity_id))
     
-    def delete_by(self, kind, **kwargs):
-        filter_by = [(key, "=", value) for key, value in kwargs.items()]
+    def delete_by(self, kind, filter_by=None, **kwargs):
+        """Delete entities matching filters with a single delete_multi(); returns their number."""
+        filter_by = list(filter_by or ()) + [(key, "=", value) for key, value in kwargs.items()]
         keys = self.get_keys_for(kind, filter_by=filter_by)
         keys = list(keys)
-        print(keys)
-        return self.delete_by_key(keys)
+        self.delete_by_key(keys, kind)
+        return len(keys)
         
 class Result:
-    def __init__(self, kind, dataset):
-        self.kind = kind
+    def __init__(self, query, dataset):
+        self.query = query
+        self.kind = query.kind
         self.dataset = iter(dataset)
     
     def __iter__(self):
@@ -81,8 +241,7 @@ class Result:
     def __next__(self):
         entry = next(self.dataset)
         entry["_id"] = entry.key.id
-        entity = self.kind._from_data(entry)
-        return entity
+        return self.query._convert(entry)
         
 
 
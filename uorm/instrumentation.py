@@ -0,0 +1,101 @@
+"""Hooks reporting every backend operation.
+
+Backends check `hooks` before building an event, so when no hook is
+installed instrumentation costs a single truth test per operation.
+"""
+import logging
+import threading
+import time
+
+hooks = ()
+
+
+class Event:
+    __slots__ = ("kind", "operation", "statement", "parameters", "rows", "duration", "error", "started")
+    
+    def __init__(self, kind, operation, statement=None, parameters=None):
+        self.kind = kind
+        self.operation = operation
+        self.statement = statement
+        self.parameters = parameters
+        self.rows = None
+        self.duration = None
+        self.error = None
+        self.started = None
+    
+    @property
+    def kind_name(self):
+        return self.kind.__name__ if isinstance(self.kind, type) else self.kind
+
+
+class Hook:
+    def before(self, event):
+        """Called before the operation is executed."""
+    
+    def after(self, event):
+        """Called after the operation with rows, duration and error filled in."""
+
+
+def add_hook(hook):
+    global hooks
+    hooks = hooks + (hook,)
+    return hook
+
+
+def remove_hook(hook):
+    global hooks
+    hooks = tuple(h for h in hooks if h is not hook)
+
+
+def start(kind, operation, statement=None, parameters=None):
+    event = Event(kind, operation, statement, parameters)
+    for hook in hooks:
+        hook.before(event)
+    event.started = time.perf_counter()
+    return event
+
+
+def finish(event, rows=None, error=None):
+    event.duration = time.perf_counter() - event.started
+    event.rows = rows
+    event.error = error
+    for hook in hooks:
+        hook.after(event)
+
+
+class LoggingHook(Hook):
+    def __init__(self, logger=None, level=logging.DEBUG, parameters=False):
+        self.logger = logger or logging.getLogger("uorm")
+        self.level = level
+        self.parameters = parameters
+    
+    def after(self, event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, "%s %s rows=%s %.3f ms%s: %s%s",
+            event.kind_name, event.operation, event.rows, event.duration * 1000,
+            " error=%r" % event.error if event.error else "", event.statement,
+            " %r" % (event.parameters,) if self.parameters else "")
+
+
+class QueryStats(Hook):
+    """Per-thread aggregate of query count and total duration, e.g. per request."""
+    def __init__(self):
+        self.local = threading.local()
+    
+    def reset(self):
+        self.local.count = 0
+        self.local.duration = 0.0
+    
+    def after(self, event):
+        local = self.local
+        local.count = getattr(local, "count", 0) + 1
+        local.duration = getattr(local, "duration", 0.0) + event.duration
+    
+    @property
+    def count(self):
+        return getattr(self.local, "count", 0)
+    
+    @property
+    def duration(self):
+        return getattr(self.local, "duration", 0.0)
@@ -0,0 +1,150 @@
+"""Unit of work: an identity map and deferred saves, scoped e.g. to a web request.
+
+While a session is active in a thread, entities loaded through EntityManager
+and Query are registered in an identity map keyed by kind and _id or a unique
+field, so repeated get() and exists() lookups are answered from memory and the
+same row is always represented by the same instance. Saves are queued and
+written in a single transaction when the session ends or before any query
+that could observe them.
+"""
+import contextlib
+import threading
+
+from .default import get_default_db
+
+_ID = "_id"
+_local = threading.local()
+
+
+class Session:
+    def __init__(self, db=None):
+        self.db = db or get_default_db()
+        # (kind, field name, value) -> entity
+        self.identity = {}
+        # (kind, field name, value) known not to exist in the database
+        self.missing = set()
+        # id(entity) -> entity, in the order of the first save
+        self.pending = {}
+        self.pending_kinds = set()
+
+    def lookup(self, kind, filters):
+        """Return (True, entity or None) if equality filters can be answered from memory, (False, None) otherwise.
+
+        Only lookups by _id or a unique field are answered. Pending saves of the kind are flushed first."""
+        keys = [(kind, name, value) for name, value in filters.items() if name in kind._unique_fields]
+        if not keys:
+            return False, None
+        for key in keys:
+            entity = self.identity.get(key)
+            if entity is not None and all(getattr(entity, name) == value for name, value in filters.items()):
+                return True, entity
+        if kind in self.pending_kinds:
+            self.flush()
+        if len(filters) == 1 and keys[0] in self.missing:
+            return True, None
+        return False, None
+
+    def add(self, entity):
+        """Register an entity loaded from the database; returns the instance already known for its _id if any."""
+        kind = entity.__class__
+        key = (kind, _ID, entity._id)
+        known = self.identity.get(key)
+        if known is not None:
+            entity = known
+        self.register(entity)
+        return entity
+
+    def register(self, entity):
+        kind = entity.__class__
+        identity = self.identity
+        for name in kind._unique_fields:
+            value = getattr(entity, name)
+            if value is not None:
+                identity[(kind, name, value)] = entity
+
+    def add_missing(self, kind, filters):
+        if len(filters) == 1:
+            name, value = next(iter(filters.items()))
+            if name in kind._unique_fields:
+                self.missing.add((kind, name, value))
+
+    def save(self, entity):
+        """Queue an entity to be saved when the session is flushed."""
+        # Keyed by identity: entities are mutable, and keeping them pending keeps their id() unique.
+        if id(entity) not in self.pending:
+            self.pending[id(entity)] = entity
+            self.pending_kinds.add(entity.__class__)
+
+    def flush(self):
+        """Save queued entities in one transaction."""
+        if not self.pending:
+            return 0
+        pending = list(self.pending.values())
+        kinds = self.pending_kinds
+        self.pending = {}
+        self.pending_kinds = set()
+        count = pending[0].entities._write(pending, self.db)
+        self.missing = set(key for key in self.missing if key[0] not in kinds)
+        for entity in pending:
+            if entity._id is not None:
+                self.register(entity)
+        return count
+
+    def forget(self, kind):
+        """Drop everything known about a kind, e.g. after its rows have been deleted."""
+        self.identity = dict((key, entity) for key, entity in self.identity.items() if key[0] is not kind)
+        self.missing = set(key for key in self.missing if key[0] is not kind)
+
+
+def current(db=None):
+    """Return the session active in this thread, if any, and bound to db if given."""
+    session = getattr(_local, "session", None)
+    if session is not None and (db is None or db is session.db):
+        return session
+    return None
+
+
+def begin(db=None):
+    if getattr(_local, "session", None) is not None:
+        raise RuntimeError("A session is already active in this thread.")
+    session = _local.session = Session(db)
+    return session
+
+
+def end(commit=True):
+    """End the active session, flushing pending saves if commit is true."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        return
+    _local.session = None
+    if commit:
+        session.flush()
+
+
+def init_app(app, db=None):
+    """Run every request of a Flask app in a session, saving its changes only for responses below 400."""
+    @app.before_request
+    def begin_unit_of_work():
+        begin(db)
+    
+    @app.after_request
+    def commit_unit_of_work(response):
+        # Failed requests must not write anything; a failing flush turns the response into an error.
+        end(commit=response.status_code < 400)
+        return response
+    
+    @app.teardown_request
+    def discard_unit_of_work(exception):
+        # Requests that raised never reach after_request.
+        end(commit=False)
+
+
+@contextlib.contextmanager
+def scope(db=None):
+    session = begin(db)
+    try:
+        yield session
+    except BaseException:
+        end(commit=False)
+        raise
+    end()
@@ -1,30 +1,130 @@
+from urllib.request import pathname2url
+from collections import namedtuple
 import threading
 import sqlite3
+import time
 
 from .default import set_default_db
 from .entity import KINDS
 from . import fields
+from . import instrumentation
 
 
 DEFAULT_LIMIT = 0x7FFFFFFF
+_ID = "_id"
+SELECT = "select"
+SELECT_KEYS = "select_keys"
+COUNT = "count"
+EXISTS = "exists"
+DELETE = "delete"
+INSERT = "insert"
+UPDATE = "update"
+SCHEMA = "schema"
+IN = "in"
+# Values bound per IN list, kept well below SQLite's default limit of 999 variables.
+MAX_IN_VALUES = 512
 SQL_TYPE_INTEGER = "INTEGER"
 SQL_TYPE_BLOB = "BLOB"
 SQL_TYPE_TEXT = "TEXT"
 
+DEFAULT_POOL_SIZE = 8
+# Seconds acquire() waits for a connection when all of them are in use.
+DEFAULT_POOL_TIMEOUT = 30
+# Rows fetched at once while a result is iterated.
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16 * 1024),
+    ("busy_timeout", 5000),
+)
+# journal_mode and synchronous cannot be changed through a read-only connection.
+READ_ONLY_PRAGMAS = tuple(p for p in DEFAULT_PRAGMAS if p[0] not in ("journal_mode", "synchronous"))
+
 SQL_TYPES = (
     (fields.String, SQL_TYPE_TEXT),
+    (fields.Integer, SQL_TYPE_INTEGER),
     (fields.Blob, SQL_TYPE_BLOB),
 )
 
 
-def connect(db_file, namespace=None):
-    set_default_db(Connection(db_file, namespace))
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+def connect(db_file, namespace=None, **kwargs):
+    set_default_db(Connection(db_file, namespace, **kwargs))
+
+
+Statement = namedtuple("Statement", "sql columns")
 
 
 def escape_sql_id(sql):
     return sql.replace("\"", "\"\"");
 
 
+def is_in(operator):
+    return operator.lower() == IN
+
+
+def in_size(count):
+    """Round IN list length up to a power of two to keep the number of statement shapes low."""
+    size = 1
+    while size < count:
+        size *= 2
+    return size if count else 0
+
+
+def chunk_filters(filter_by):
+    """Split IN lists longer than MAX_IN_VALUES, returning a filter_by list per chunk."""
+    chunks = [[]]
+    for name, operator, value in filter_by:
+        if is_in(operator):
+            # Without duplicates, chunks match disjoint sets of rows.
+            values = list(dict.fromkeys(value))
+            parts = [values[i:i + MAX_IN_VALUES] for i in range(0, len(values), MAX_IN_VALUES)] or [values]
+        else:
+            parts = [value]
+        chunks = [chunk + [(name, operator, part)] for chunk in chunks for part in parts]
+    return chunks
+
+
+def null_safe_key(name):
+    """Sort key of rows by a column ordering NULLs first, like SQLite does in ascending order."""
+    return lambda row: (row[name] is not None, row[name])
+
+
+def sort_rows(rows, order_by):
+    for order in reversed(order_by):
+        rows.sort(key=null_safe_key(order.lstrip("-")), reverse=order[0] == "-")
+
+
+def keyset_condition(table_name, order_by):
+    """Return SQL matching rows after a keyset position and, for each placeholder, the index of its value.
+    
+    Uniform directions use a row value comparison, which SQLite can satisfy with an index range scan.
+    NULL sort keys are not supported."""
+    columns = []
+    descending = []
+    for order in order_by:
+        descending.append(order[0] == "-")
+        columns.append('"{0}"."{1}"'.format(table_name, escape_sql_id(order.lstrip("-"))))
+    if len(set(descending)) == 1:
+        sql = "({}) {} ({})".format(", ".join(columns), "<" if descending[0] else ">",
+            ", ".join(("?",) * len(columns)))
+        return sql, tuple(range(len(columns)))
+    
+    terms = []
+    indexes = []
+    for i, column in enumerate(columns):
+        term = ["{} = ?".format(c) for c in columns[:i]]
+        term.append("{} {} ?".format(column, "<" if descending[i] else ">"))
+        terms.append("(" + " AND ".join(term) + ")")
+        indexes.extend(range(i + 1))
+    return "(" + " OR ".join(terms) + ")", tuple(indexes)
+
+
 def dict_factory(cursor, row):
     data = {}
     for index, desc in enumerate(cursor.description):
@@ -32,60 +132,215 @@ def dict_factory(cursor, row):
     return data
 
 
+class ConnectionPool:
+    """Pool of at most `size` SQLite connections with thread affinity.
+    
+    A thread keeps the connection it acquired, with its warm page cache, until
+    it calls release(); released connections are reused by other threads. When
+    all connections are taken, acquire() waits for a release, taking over
+    connections of threads that have exited, and raises PoolTimeout after
+    `timeout` seconds.
+    """
+    def __init__(self, db_file, size=DEFAULT_POOL_SIZE, pragmas=DEFAULT_PRAGMAS, read_only=False,
+    timeout=DEFAULT_POOL_TIMEOUT):
+        self.db_file = db_file
+        self.size = size
+        self.pragmas = pragmas
+        self.read_only = read_only
+        self.timeout = timeout
+        self.lock = threading.Condition(threading.Lock())
+        self.local = threading.local()
+        self.idle = []
+        # Open connections, including those being opened, mapped to the thread holding them.
+        self.connections = {}
+        self.closed = False
+    
+    def open(self):
+        if self.read_only:
+            conn = sqlite3.connect("file:%s?mode=ro" % pathname2url(self.db_file), uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.row_factory = dict_factory
+        for name, value in self.pragmas:
+            conn.execute("PRAGMA {} = {};".format(name, value))
+        return conn
+    
+    def acquire(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            return conn
+        thread = threading.current_thread()
+        deadline = None
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError("Connection pool has been closed.")
+                if not self.idle and len(self.connections) < self.size:
+                    # Reserve a slot; the connection is opened outside the lock.
+                    slot = object()
+                    self.connections[slot] = thread
+                    break
+                if self.idle or self.reclaim():
+                    conn = self.idle.pop()
+                    self.connections[conn] = thread
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout("All %d connections to %s are in use." % (self.size, self.db_file))
+                self.lock.wait(remaining)
+        if conn is None:
+            try:
+                conn = self.open()
+            finally:
+                with self.lock:
+                    del self.connections[slot]
+                    if conn is not None:
+                        self.connections[conn] = thread
+                    self.lock.notify()
+        self.local.conn = conn
+        return conn
+    
+    def reclaim(self):
+        """Move connections of exited threads to idle ones; returns whether there were any. Needs the lock."""
+        for conn, thread in list(self.connections.items()):
+            if not thread.is_alive() and isinstance(conn, sqlite3.Connection):
+                del self.connections[conn]
+                self.idle.append(conn)
+        return bool(self.idle)
+    
+    def release(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            return
+        self.local.conn = None
+        with self.lock:
+            if conn in self.connections:
+                del self.connections[conn]
+                if not self.closed:
+                    self.idle.append(conn)
+                    self.lock.notify()
+                    return
+        conn.close()
+    
+    def close(self):
+        with self.lock:
+            self.closed = True
+            connections = [conn for conn in self.connections if isinstance(conn, sqlite3.Connection)]
+            connections.extend(self.idle)
+            self.connections.clear()
+            del self.idle[:]
+            self.lock.notify_all()
+        for conn in connections:
+            conn.close()
+
+
 class Connection:
-    def __init__(self, db_file, namespace=None):
+    def __init__(self, db_file, namespace=None, pool_size=DEFAULT_POOL_SIZE, pragmas=DEFAULT_PRAGMAS,
+    read_only_queries=False, batch_size=DEFAULT_BATCH_SIZE, plan_audit=None, pool_timeout=DEFAULT_POOL_TIMEOUT):
         self.db_file = db_file
         self.namespace = namespace
-        self.conn_key = "%s:%s" % (db_file, namespace or "")
+        self.batch_size = batch_size
+        self.plan_audit = plan_audit
+        self.pool = ConnectionPool(db_file, pool_size, pragmas, timeout=pool_timeout)
+        self.statements = {}
+        self.keyset_conditions = {}
+        self.insert_statements = {}
+        self.update_statements = {}
         self.create_tables()
+        if read_only_queries:
+            self.read_pool = ConnectionPool(db_file, pool_size, READ_ONLY_PRAGMAS, read_only=True,
+                timeout=pool_timeout)
+        else:
+            self.read_pool = self.pool
+    
+    def release(self):
+        """Return the current thread's connections to the pool."""
+        self.pool.release()
+        self.read_pool.release()
+    
+    def close(self):
+        self.pool.close()
+        self.read_pool.close()
     
     def create_tables(self):
-        sql = []
-        for kind in KINDS:
-            sql.append(self.create_table_sql(kind))
-        sql = "".join(sql)
+        # Indexes come last: SQLite reads a quoted name of a column that does not exist yet as a string
+        # literal, so indexing it before ALTER TABLE adds the column would index a constant.
+        tables = "".join(self.create_table_sql(kind) for kind in KINDS)
+        indexes = "".join(self.create_indexes_sql(kind) for kind in KINDS)
         with self.conn as conn:
-            print(sql)
-            conn.executescript(sql)
+            self.execute(conn, None, SCHEMA, tables, script=True)
+            for kind in KINDS:
+                self.add_missing_columns(conn, kind)
+            self.execute(conn, None, SCHEMA, indexes, script=True)
+        for kind in KINDS:
+            self.compile_statements(kind)
+    
+    def add_missing_columns(self, conn, kind):
+        table_name = self.table_name(kind)
+        existing = set(row["name"] for row in conn.execute('PRAGMA table_info("%s");' % table_name))
+        for name, field in kind._fields:
+            if name not in existing:
+                sql = 'ALTER TABLE "{}" ADD COLUMN {};'.format(table_name, self.column_sql(name, field))
+                self.execute(conn, kind, SCHEMA, sql)
+    
+    def column_sql(self, name, field):
+        for field_type, sql_type in SQL_TYPES:
+            if isinstance(field, field_type):
+                break
+        else:
+            sql_type = SQL_TYPE_BLOB
+        return "{} {}".format(escape_sql_id(name), sql_type)
     
     def create_table_sql(self, kind):
         table_name = self.table_name(kind)
         sql = ["CREATE TABLE IF NOT EXISTS \"%s\" (" % table_name]
         sql.append("\n {} {} PRIMARY KEY AUTOINCREMENT".format(escape_sql_id("_id"), SQL_TYPE_INTEGER))
-        indexes = []
         for i, field_tuple in enumerate(kind._fields):
             name, field = field_tuple
-            for field_type, sql_type in SQL_TYPES:
-                if isinstance(field, field_type):
-                    break
-            else:
-                sql_type = SQL_TYPE_BLOB
-            sql.append(",\n {} {}".format(escape_sql_id(name), sql_type))
-            if field.index:
-                indexes.append(name)
+            sql.append(",\n " + self.column_sql(name, field))
             if field.unique:
                 sql.append(" UNIQUE")
             if not field.empty:
                 sql.append(" NOT NULL")
         sql.append("\n);\n")
-        for name in indexes:
-            sql.append('CREATE INDEX IF NOT EXISTS "{0}_{1}_index" ON "{0}" ("{1}");\n'.format(
-                self.table_name(kind), escape_sql_id(name)))
         sql = "".join(sql)
         return sql
     
+    def create_indexes_sql(self, kind):
+        table_name = self.table_name(kind)
+        sql = []
+        for name, field in kind._fields:
+            if field.index or field.include:
+                columns = field.index_columns()
+                # UNIQUE already creates an index on the column alone.
+                if field.unique_index:
+                    sql.append(self.create_index_sql(table_name, columns, unique=True))
+                    # Replaces a plain index on the same columns created before it was made unique.
+                    sql.append('DROP INDEX IF EXISTS "{}";\n'.format(self.index_name(table_name, columns)))
+                elif not (field.unique and columns == (name,)):
+                    sql.append(self.create_index_sql(table_name, columns))
+        return "".join(sql)
+    
+    def index_name(self, table_name, columns, unique=False):
+        names = [c.lstrip("-") for c in columns]
+        return escape_sql_id("{}_{}_{}".format(table_name, "_".join(names), "unique" if unique else "index"))
+    
+    def create_index_sql(self, table_name, columns, unique=False):
+        """Columns are names, prefixed with "-" for descending order."""
+        definitions = ", ".join('"{}"{}'.format(escape_sql_id(c.lstrip("-")), " DESC" if c[0] == "-" else "")
+            for c in columns)
+        return 'CREATE {0}INDEX IF NOT EXISTS "{1}" ON "{2}" ({3});\n'.format(
+            "UNIQUE " if unique else "", self.index_name(table_name, columns, unique), table_name, definitions)
+    
     @property
     def conn(self):
-        local = threading.local()
-        connections = getattr(local, "sqlite3connections", None)
-        if connections is None:
-            local.sqlite3connections = connections = {}
-        try:
-            return connections[self.conn_key]
-        except KeyError:
-            connections[self.conn_key] = conn = sqlite3.connect(self.db_file)
-            conn.row_factory = dict_factory
-            return conn
+        return self.pool.acquire()
+    
+    @property
+    def read_conn(self):
+        return self.read_pool.acquire()
     
     def table_name(self, kind):
         name = kind.__name__
@@ -94,116 +349,294 @@ class Connection:
         return escape_sql_id(name)
     
     def save(self, entity):
+        """Insert a new entity or update only the changed columns of an existing one."""
         kind = entity.__class__
-        data = entity._as_data()
-        pk = data.get("_id")
-        columns = []
-        values = []
-        for i, field_tuple in enumerate(kind._fields):
-            name, field = field_tuple
-            columns.append(escape_sql_id(name))
-            values.append(data.get(name))
-                
+        pk = entity._id
         if pk is None:
-            sql = ['INSERT INTO\n "{}"("'.format(self.table_name(kind))]
-            sql.append('", "'.join(columns))
-            sql.append('")\n VALUES(')
-            sql.append(', '.join(('?',) * len(columns)))
-            sql.append(');');
-            sql = "".join(sql)
-            print(">>>", sql, values)
+            data = entity._as_data()
+            statement = self.insert_statements[kind]
+            values = [data.get(name) for name in statement.columns]
             with self.conn as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, values)
+                cursor = self.execute(conn, kind, INSERT, statement.sql, values)
                 entity._id = cursor.lastrowid
         else:
-            sql = ['UPDATE "{}" SET\n '.format(self.table_name(kind))]
-            sql.append(', '.join('"{}" = ?'.format(c) for c in columns))
-            sql.append('\n WHERE "_id" = ?;')
-            sql = "".join(sql)
+            data = entity._dirty_data()
+            if not data:
+                return False
+            statement = self.update_statement(kind, data)
+            values = [data[name] for name in statement.columns]
             values.append(pk)
-            print(">>>", sql, values)
             with self.conn as conn:
-                conn.execute(sql, values)
+                self.execute(conn, kind, UPDATE, statement.sql, values)
+        entity._mark_saved(data)
+        return True
     
-    def query(self, kind, offset=None, limit=None, order_by=None):
-        raise NotImplementedError
+    def bulk_save(self, entities):
+        """Insert new and update existing entities with executemany() in one transaction.
+        
+        Updates are grouped by the set of changed columns."""
+        inserts = {}
+        updates = {}
+        for entity in entities:
+            kind = entity.__class__
+            if entity._id is None:
+                inserts.setdefault(kind, []).append((entity, entity._as_data()))
+            else:
+                data = entity._dirty_data()
+                if data:
+                    statement = self.update_statement(kind, data)
+                    updates.setdefault(statement, []).append((entity, data))
+        
+        with self.conn as conn:
+            for kind, rows in inserts.items():
+                statement = self.insert_statements[kind]
+                values = [[data.get(name) for name in statement.columns] for entity, data in rows]
+                self.execute(conn, kind, INSERT, statement.sql, values, many=True)
+                # The transaction holds the write lock and AUTOINCREMENT ids only grow,
+                # so the ids of the inserted rows are consecutive.
+                last_id = conn.execute("SELECT last_insert_rowid() AS id;").fetchone()["id"]
+                first_id = last_id - len(rows) + 1
+                for i, row in enumerate(rows):
+                    row[0]._id = first_id + i
+            for statement, rows in updates.items():
+                values = [[data[name] for name in statement.columns] + [entity._id] for entity, data in rows]
+                self.execute(conn, rows[0][0].__class__, UPDATE, statement.sql, values, many=True)
+        for rows in inserts.values():
+            for entity, data in rows:
+                entity._mark_saved(data)
+        for rows in updates.values():
+            for entity, data in rows:
+                entity._mark_saved(data)
     
-    def get_keys_for(self, kind, **query):
-        cursor = self.conn.cursor()
-        table_name = self.table_name(kind)
-        sql = ['SELECT "{0}"."{1}" AS "{1}" FROM "{0}"'.format(table_name, escape_sql_id("_id"))]
-        bound_values = []
-        self.append_query(sql, bound_values, kind, **query)
-        sql.append(";")
-        sql = "".join(sql)
-        print(">>>", sql, bound_values)
-        result = cursor.execute(sql, bound_values)
-        return (row["_id"] for row in result.fetchall())
+    def update_statement(self, kind, data):
+        """Return the cached UPDATE statement setting only the columns present in data."""
+        columns = tuple(name for name, field in kind._fields if name in data)
+        key = (kind, columns)
+        try:
+            return self.update_statements[key]
+        except KeyError:
+            pass
+        sql = ['UPDATE "{}" SET\n '.format(self.table_name(kind))]
+        sql.append(', '.join('"{}" = ?'.format(escape_sql_id(c)) for c in columns))
+        sql.append('\n WHERE "_id" = ?;')
+        statement = self.update_statements[key] = Statement("".join(sql), columns)
+        return statement
     
-    def exec_query(self, query):
-        kind = query.kind
-        cursor = self.conn.cursor()
-        table_name = self.table_name(kind)
-        sql = ["SELECT "]
-        bound_values = []
+    def execute(self, conn, kind, operation, sql, values=(), script=False, many=False):
+        """Execute a statement on a new cursor, reporting it to instrumentation hooks."""
+        cursor = conn.cursor()
+        if not instrumentation.hooks:
+            if script:
+                cursor.executescript(sql)
+            elif many:
+                cursor.executemany(sql, values)
+            else:
+                cursor.execute(sql, values)
+            return cursor
         
-        sql.append(' "{0}"."{1}" AS "{1}"'.format(table_name, escape_sql_id("_id")))
-        for i, field_tuple in enumerate(kind._fields):
-            field_name, field = field_tuple
-            sql.append(",")
-            sql.append(" \"{0}\".\"{1}\" AS \"{1}\"".format(table_name, escape_sql_id(field_name)))
+        event = instrumentation.start(kind, operation, sql, values)
+        try:
+            if script:
+                cursor.executescript(sql)
+            elif many:
+                cursor.executemany(sql, values)
+            else:
+                cursor.execute(sql, values)
+        except Exception as e:
+            instrumentation.finish(event, error=e)
+            raise
+        instrumentation.finish(event, cursor.rowcount if cursor.rowcount >= 0 else None)
+        return cursor
+    
+    def compile_statements(self, kind):
+        """Precompute the INSERT statement of a kind; UPDATE statements are built per set of changed columns."""
+        table_name = self.table_name(kind)
+        columns = tuple(name for name, field in kind._fields)
+        escaped = [escape_sql_id(name) for name in columns]
+        sql = ['INSERT INTO\n "{}"("'.format(table_name)]
+        sql.append('", "'.join(escaped))
+        sql.append('")\n VALUES(')
+        sql.append(', '.join(('?',) * len(columns)))
+        sql.append(');');
+        self.insert_statements[kind] = Statement("".join(sql), columns)
+    
+    def query(self, kind, offset=None, limit=None, order_by=None):
+        raise NotImplementedError
+    
+    def compile(self, operation, kind, filter_by=None, order_by=None, limit=None, offset=None, fields=None,
+    after=None):
+        """Return the cached statement for the shape of a query and values to bind to it.
         
-        sql.append(" FROM \"%s\"" % table_name);
-        if query.filter_by:
-            sql.append(" WHERE")
-            for i, filter_tuple in enumerate(query.filter_by):
-                name, operator, value = filter_tuple
-                if i != 0:
-                    sql.append(" AND")
-                sql.append(" \"{0}\".\"{1}\" {2} ?".format(table_name, escape_sql_id(name), operator))
+        The shape consists of the operation, selected fields, filtered columns and operators,
+        ordering and the presence of a keyset position, limit and offset, so it never depends on the bound
+        values. IN lists are padded to a power of two by repeating their last value. If after is given,
+        order_by must be the keyset order of the query."""
+        bound_values = []
+        filters = []
+        for name, operator, value in filter_by or ():
+            if is_in(operator):
+                value = list(value)
+                size = in_size(len(value))
+                bound_values.extend(value)
+                bound_values.extend(value[-1:] * (size - len(value)))
+                filters.append((name, operator, size))
+            else:
                 bound_values.append(value)
-        if query.order_by:
-            sql.append(" ORDER BY")
-            for i, order in enumerate(query.order_by):
-                if i != 0:
-                    sql.append(",")
-                if order[0] == "-":
-                    order = order[1:]
-                    direction = "DESC"
-                else:
-                    direction = "ASC"
-                sql.append(" \"{0}\".\"{1}\" {2}".format(table_name, escape_sql_id(order), direction))
+                filters.append((name, operator))
+        order_by = tuple(order_by) if order_by else ()
+        if after is not None:
+            if len(after) != len(order_by):
+                raise ValueError("Keyset position %r does not match order %r." % (after, order_by))
+            # The condition refers to columns by table name, so it is specific to the kind.
+            keyset = self.keyset_conditions.get((kind, order_by))
+            if keyset is None:
+                keyset = keyset_condition(self.table_name(kind), order_by)
+                self.keyset_conditions[(kind, order_by)] = keyset
+            bound_values.extend(after[i] for i in keyset[1])
+        offset = offset or None
+        if offset is not None:
+            bound_values.append(limit if limit is not None else DEFAULT_LIMIT)
+            bound_values.append(offset)
+        elif limit is not None:
+            bound_values.append(limit)
         
-        if query.offset is not None:
-            limit = query.limit if query.limit is not None else DEFAULT_LIMIT
-            offset = query.offset
-            sql.append(" LIMIT {0} OFFSET {1}".format(limit, offset))
-        elif query.limit is not None:
-            sql.append(" LIMIT {0}".format(query.limit))
+        key = (operation, kind, tuple(filters), order_by, after is not None,
+            limit is not None, offset is not None, fields)
+        try:
+            statement = self.statements[key]
+            if self.plan_audit is not None:
+                self.plan_audit.used(key)
+            return statement, bound_values
+        except KeyError:
+            pass
         
+        table_name = self.table_name(kind)
+        if operation == SELECT:
+            columns = fields or (_ID,) + tuple(name for name, field in kind._fields)
+            sql = ["SELECT "]
+            sql.append(", ".join(' "{0}"."{1}" AS "{1}"'.format(table_name, escape_sql_id(c)) for c in columns))
+            sql.append(" FROM \"%s\"" % table_name);
+        elif operation == SELECT_KEYS:
+            columns = (_ID,)
+            sql = ['SELECT "{0}"."{1}" AS "{1}" FROM "{0}"'.format(table_name, escape_sql_id(_ID))]
+        elif operation == COUNT:
+            columns = ("count",)
+            sql = ['SELECT COUNT(*) AS "count" FROM "{0}"'.format(table_name)]
+        elif operation == EXISTS:
+            columns = ("exists",)
+            sql = ['SELECT 1 AS "exists" FROM "{0}"'.format(table_name)]
+        elif operation == DELETE:
+            columns = ()
+            sql = ['DELETE FROM "{0}"'.format(table_name)]
+        else:
+            raise ValueError("Unknown operation '%s'." % operation)
+        keyset_sql = keyset[0] if after is not None else None
+        if operation in (COUNT, EXISTS, DELETE):
+            # Keyset order still shapes the keyset condition, but rows need not be sorted.
+            order_by = ()
+        self.append_query(sql, table_name, key[2], order_by, keyset_sql, key[5], key[6])
         sql.append(";")
-        sql = "".join(sql)
-        print(">>>", sql, bound_values)
-        result = cursor.execute(sql, bound_values)
-        return Result(query.kind, result)
+        statement = self.statements[key] = Statement("".join(sql), columns)
+        if self.plan_audit is not None:
+            selective = bool(filters) or after is not None or limit is not None
+            self.plan_audit.record(key, kind, operation, statement.sql,
+                self.explain(statement.sql, bound_values), selective)
+        return statement, bound_values
     
-    def append_query(self, sql, bound_values, kind, **query):
-        table_name = self.table_name(kind)
+    def explain(self, sql, values=()):
+        """Return the details of EXPLAIN QUERY PLAN of a statement."""
+        return [row["detail"] for row in self.read_conn.execute("EXPLAIN QUERY PLAN " + sql, values)]
+    
+    def enable_plan_audit(self, audit):
+        """Record plans of query shapes in a uorm.audit.PlanAudit, or stop with None.
+        
+        Compiled statements are dropped so that shapes seen before are audited as well."""
+        self.plan_audit = audit
+        self.statements.clear()
+    
+    def get_keys_for(self, kind, **query):
         filter_by = query.get("filter_by")
-        if filter_by:
+        keys = []
+        for chunk in chunk_filters(filter_by) if filter_by else [None]:
+            statement, bound_values = self.compile(SELECT_KEYS, kind, chunk, query.get("order_by"),
+                query.get("limit"), query.get("offset"))
+            result = self.execute(self.read_conn, kind, SELECT_KEYS, statement.sql, bound_values)
+            keys.extend(row["_id"] for row in result.fetchall())
+        return iter(keys)
+    
+    def exec_query(self, query):
+        if query.after is not None:
+            order_by = query.keyset_order()
+        else:
+            order_by = query.order_by
+        batch_size = query.batch_size or self.batch_size
+        chunks = chunk_filters(query.filter_by) if query.filter_by else [None]
+        if len(chunks) == 1:
+            statement, bound_values = self.compile(SELECT, query.kind, chunks[0], order_by,
+                query.limit, query.offset, query.fields, query.after)
+            result = self.execute(self.read_conn, query.kind, SELECT, statement.sql, bound_values)
+            return Result(query, result, batch_size)
+        
+        # Each chunk is a separate statement, so ordering and paging are applied to the union
+        # of rows before they are converted. Projections select the ordered columns as well.
+        fields = query.fields
+        if fields is not None and order_by:
+            fields = fields + tuple(dict.fromkeys(
+                name for name in (order.lstrip("-") for order in order_by) if name not in fields))
+        rows = []
+        for chunk in chunks:
+            statement, bound_values = self.compile(SELECT, query.kind, chunk, order_by, fields=fields,
+                after=query.after)
+            rows.extend(self.execute(self.read_conn, query.kind, SELECT, statement.sql, bound_values))
+        if order_by:
+            sort_rows(rows, order_by)
+        offset = query.offset or 0
+        stop = offset + query.limit if query.limit is not None else None
+        return (query._convert(row) for row in rows[offset:stop])
+    
+    def count(self, query):
+        """Count matching rows with SELECT COUNT(*); limit and offset are applied to the count."""
+        order_by = query.keyset_order() if query.after is not None else None
+        total = 0
+        for chunk in chunk_filters(query.filter_by) if query.filter_by else [None]:
+            statement, bound_values = self.compile(COUNT, query.kind, chunk, order_by, after=query.after)
+            total += self.execute(self.read_conn, query.kind, COUNT, statement.sql, bound_values).fetchone()["count"]
+        total = max(0, total - (query.offset or 0))
+        return min(total, query.limit) if query.limit is not None else total
+    
+    def exists(self, query):
+        """Check for a matching row with SELECT 1 ... LIMIT 1."""
+        order_by = query.keyset_order() if query.after is not None else None
+        chunks = chunk_filters(query.filter_by) if query.filter_by else [None]
+        if len(chunks) > 1 and query.offset:
+            # The offset applies to the union of chunks.
+            return self.count(query) > 0
+        for chunk in chunks:
+            statement, bound_values = self.compile(EXISTS, query.kind, chunk, order_by, 1, query.offset,
+                after=query.after)
+            if self.execute(self.read_conn, query.kind, EXISTS, statement.sql, bound_values).fetchone():
+                return True
+        return False
+    
+    def append_query(self, sql, table_name, filters, order_by, keyset_sql, has_limit, has_offset):
+        if filters:
             sql.append(" WHERE")
-            for i, filter_tuple in enumerate(filter_by):
-                name, operator, value = filter_tuple
+            for i, filter_tuple in enumerate(filters):
+                name, operator = filter_tuple[:2]
                 if i != 0:
                     sql.append(" AND")
-                sql.append(" \"{0}\".\"{1}\" {2} ?".format(table_name, escape_sql_id(name), operator))
-                bound_values.append(value)
+                sql.append(" \"{0}\".\"{1}\" {2}".format(table_name, escape_sql_id(name), operator))
+                if len(filter_tuple) > 2:
+                    sql.append(" (" + ", ".join(("?",) * filter_tuple[2]) + ")")
+                else:
+                    sql.append(" ?")
+        if keyset_sql:
+            sql.append(" AND " if filters else " WHERE ")
+            sql.append(keyset_sql)
         
-        order_by = query.get("order_by")
         if order_by:
             sql.append(" ORDER BY")
-            for i, order in enumerate(query.order_by):
+            for i, order in enumerate(order_by):
                 if i != 0:
                     sql.append(",")
                 if order[0] == "-":
@@ -213,55 +646,45 @@ class Connection:
                     direction = "ASC"
                 sql.append(" \"{0}\".\"{1}\" {2}".format(table_name, escape_sql_id(order), direction))
         
-        offset = query.get("offset")
-        if offset is not None:
-            limit = query.get("limit", DEFAULT_LIMIT)
-            sql.append(" LIMIT {0} OFFSET {1}".format(limit, offset))
-        else:
-            limit = query.get("limit")
-            if limit is not None:
-                sql.append(" LIMIT {0}".format(limit))
+        if has_offset:
+            sql.append(" LIMIT ? OFFSET ?")
+        elif has_limit:
+            sql.append(" LIMIT ?")
         
     def delete_by_key(self, kind, keys):
-        sql = [
-            'DELETE FROM "{0}" WHERE "{0}"."{1}" IN ('.format(self.table_name(kind), escape_sql_id("_id")),
-            ', '.join('?' * len(keys)),
-            ');'
-        ]
-        sql = "".join(sql)
-        bound_values = keys
-        print(">>>", sql, bound_values)
-        with self.conn as conn:
-            result = conn.execute(sql, bound_values)
-            return result
+        return self.delete_by(kind, filter_by=[(_ID, IN, keys)])
         
     def delete(self, kind, entity_id):
         return self.client.delete(self.create_key(kind, entity_id))
     
-    def delete_by(self, kind, **kwargs):
-        filter_by = [(key, "=", value) for key, value in kwargs.items()]
-        sql = ['DELETE FROM "{0}"'.format(self.table_name(kind))]
-        bound_values = []
-        self.append_query(sql, bound_values, kind, filter_by=filter_by)
-        sql.append(';')
-        sql = "".join(sql)
-        print(">>>", sql, bound_values)
+    def delete_by(self, kind, filter_by=None, **kwargs):
+        """Delete entities matching filters in one transaction; returns the number of deleted rows."""
+        filter_by = list(filter_by or ()) + [(key, "=", value) for key, value in kwargs.items()]
+        deleted = 0
         with self.conn as conn:
-            result = conn.execute(sql, bound_values)
-            return result
+            for chunk in chunk_filters(filter_by):
+                statement, bound_values = self.compile(DELETE, kind, chunk)
+                deleted += self.execute(conn, kind, DELETE, statement.sql, bound_values).rowcount
+        return deleted
         
 class Result:
-    def __init__(self, kind, dataset):
-        self.kind = kind
+    def __init__(self, query, dataset, batch_size=DEFAULT_BATCH_SIZE):
+        self.query = query
+        self.kind = query.kind
         self.dataset = dataset
+        self.batch_size = batch_size
+        self.batch = iter(())
     
     def __iter__(self):
         return self
     
     def __next__(self):
-        entry = self.dataset.fetchone()
-        if entry is None:
-            raise StopIteration
-        
-        entity = self.kind._from_data(entry)
-        return entity
+        try:
+            entry = next(self.batch)
+        except StopIteration:
+            rows = self.dataset.fetchmany(self.batch_size)
+            if not rows:
+                raise
+            self.batch = iter(rows)
+            entry = next(self.batch)
+        return self.query._convert(entry)